@@ -0,0 +1,282 @@
+'''
+Throughput benchmarks for every stage on synthetic data.
+
+Usage:
+python run_benchmarks.py [--scales 1 4 16] [--stages parse tag ...] [--save_baseline]
+
+Input: synthetic corpus, wordlists and feature files (generated by synthetic.py into --data_dir)
+Output: time, rows/sec and peak memory per stage and scale, written to --results.
+        Stages slower or larger than in --baseline by more than --tolerance are flagged
+        as regressions and the script exits with status 1.
+
+With --startup, the start-up time of every `python -m lcp <command> --help` is measured as well
+(best of --repeat fresh interpreters); commands slower than --startup_budget seconds are regressions.
+`--startup --stages` (no stages) only measures start-up, without generating any data.
+
+Scale 1 is --tokens corpus tokens and --words words for feature extraction and prediction.
+Time is the best of --repeat runs; peak memory (Python allocations, including numpy and pandas
+buffers) is measured with tracemalloc in one extra run, so tracing does not slow down the timed ones.
+'''
+import os
+import io
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import contextlib
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.join(BENCHMARK_DIR, '..')
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'context_based', 'src'))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'feature_based', 'src'))
+
+from synthetic import generate
+from parse_bnc_xml import parse_bnc_xml, iterparse_bnc_xml, parse_bnc_xml_metadata, COLUMNS
+from tag_cefr import load_cefr_lexicon, tag_cefr_vectorized
+from cefr_disambiguation import SentenceLevelDisambiguator
+from filter_unk import filter_unk_df
+from feature_extractor import FeatureExtractor, load_feature_file, _syllable_memo
+from lcp.cli import COMMANDS
+
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+RESULTS_FILE = 'benchmark_results.json'
+STARTUP_BUDGET = 0.5  # seconds for `python -m lcp <command> --help`, also checked by tests/test_startup.py
+STAGES = ['parse', 'iterparse', 'metadata', 'tag', 'disambiguate', 'filter', 'make_dataframe', 'predict']
+
+
+def prepare_data(data_dir, scale, tokens, words):
+    '''
+    Synthetic inputs for one scale, generated once and reused by later runs.
+    '''
+    out_dir = os.path.join(data_dir, f'scale_{scale}')
+    paths_file = os.path.join(out_dir, 'paths.json')
+    if os.path.exists(paths_file):
+        with open(paths_file, 'r') as f:
+            return json.load(f)
+
+    print(f'Generating scale {scale} in {out_dir}...')
+    paths = generate(out_dir, tokens * scale, n_words=words * scale)
+    with open(paths_file, 'w') as f:
+        json.dump(paths, f)
+    return paths
+
+
+# Each stage has a setup (untimed, returns the stage input) and a run (timed, returns the rows processed).
+class Stages:
+    def __init__(self, paths):
+        self.paths = paths
+        self.file_paths = sorted(glob.glob(os.path.join(paths['texts_dir'], '*', '**', '*.xml'), recursive=True))
+        self.cache = {}
+
+    def tokens(self):
+        if 'tokens' not in self.cache:
+            self.cache['tokens'] = pd.DataFrame([r for f in self.file_paths for r in parse_bnc_xml(f)], columns=COLUMNS)
+        return self.cache['tokens']
+
+    def lexicon(self):
+        if 'lexicon' not in self.cache:
+            self.cache['lexicon'] = load_cefr_lexicon(self.paths['cefr_wordlist'], self.paths['extended_wordlist'])
+        return self.cache['lexicon']
+
+    def tagged(self):
+        if 'tagged' not in self.cache:
+            lexicon = self.lexicon()
+            df = self.tokens().copy()
+            df['CEFR'] = tag_cefr_vectorized(df, lexicon['cefr_table'], lexicon['extended_cefr_table'])
+            self.cache['tagged'] = df
+        return self.cache['tagged']
+
+    def words(self):
+        with open(self.paths['wordlist'], 'r') as f:
+            return f.read().split('\n')
+
+    def setup_parse(self):
+        return self.file_paths
+
+    def run_parse(self, file_paths):
+        df = pd.DataFrame([r for f in file_paths for r in parse_bnc_xml(f)], columns=COLUMNS)
+        return len(df)
+
+    def setup_iterparse(self):
+        return self.file_paths
+
+    def run_iterparse(self, file_paths):
+        return sum(len(pd.DataFrame(batch, columns=COLUMNS)) for f in file_paths for batch in iterparse_bnc_xml(f))
+
+    def setup_metadata(self):
+        return self.file_paths
+
+    def run_metadata(self, file_paths):
+        return len(pd.DataFrame([parse_bnc_xml_metadata(f) for f in file_paths]))
+
+    def setup_tag(self):
+        lexicon = self.lexicon()
+        return self.tokens(), lexicon['cefr_table'], lexicon['extended_cefr_table']
+
+    def run_tag(self, state):
+        df, cefr_table, extended_cefr_table = state
+        return len(tag_cefr_vectorized(df, cefr_table, extended_cefr_table))
+
+    # the tagger with sentence-level disambiguation, timed next to the plain tagger; a fresh disambiguator per
+    # run, so its decision cache is filled within the run
+    def setup_disambiguate(self):
+        return self.tokens(), self.lexicon()
+
+    def run_disambiguate(self, state):
+        df, lexicon = state
+        disambiguator = SentenceLevelDisambiguator(lexicon)
+        return len(tag_cefr_vectorized(df, lexicon['cefr_table'], lexicon['extended_cefr_table'], disambiguator))
+
+    def setup_filter(self):
+        return self.tagged()
+
+    def run_filter(self, df):
+        filter_unk_df(df)
+        return len(df)
+
+    def setup_make_dataframe(self):
+        feature_columns = [c for c in pd.read_csv(self.paths['feature_file'], nrows=0).columns if c != 'word']
+        features_to_use = {'surface_features': [],
+                           'extract_from_file': {os.path.basename(self.paths['feature_file']): feature_columns}}
+        return FeatureExtractor(self.words(), os.path.dirname(self.paths['feature_file']), features_to_use)
+
+    def run_make_dataframe(self, extractor):
+        # include reading the feature file and estimating syllables, as a fresh process would
+        load_feature_file.cache_clear()
+        _syllable_memo.clear()
+        return len(extractor.make_dataframe())
+
+    def setup_predict(self):
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        df = pd.read_csv(self.paths['train_features'])
+        features = df.drop(['word', 'score'], axis=1).to_numpy()
+        return HistGradientBoostingRegressor(random_state=777).fit(features, df['score']), features
+
+    def run_predict(self, state):
+        model, features = state
+        return len(model.predict(features))
+
+
+def measure(stages, stage, repeat):
+    state = getattr(stages, f'setup_{stage}')()
+    run = getattr(stages, f'run_{stage}')
+
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            rows = run(state)
+            times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = min(times)
+    return {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / max(seconds, 1e-9), 'peak_mb': peak / 2 ** 20}
+
+
+# Seconds until `python -m lcp <command> --help` exits, in a fresh interpreter
+def measure_startup(commands, repeat):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    startup = {}
+    for command in commands:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-m', 'lcp'] + ([command] if command else []) + ['--help'],
+                           env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        startup[command or 'lcp'] = min(times)
+    return startup
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result['rows_per_sec'] < base['rows_per_sec'] * (1 - tolerance):
+            regressions.append(f"{key}: {result['rows_per_sec']:.0f} rows/sec, baseline {base['rows_per_sec']:.0f}")
+        if result['peak_mb'] > base['peak_mb'] * (1 + tolerance):
+            regressions.append(f"{key}: peak {result['peak_mb']:.1f} MB, baseline {base['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(args):
+    results = {}
+    for scale in args.scales if args.stages else []:
+        stages = Stages(prepare_data(args.data_dir, scale, args.tokens, args.words))
+        for stage in args.stages:
+            result = measure(stages, stage, args.repeat)
+            results[f'{stage}@{scale}'] = result
+            print(f"{stage:>15} x{scale:<3} {result['rows']:>10} rows | {result['seconds']:8.3f}s | "
+                  f"{result['rows_per_sec']:>12.0f} rows/sec | peak {result['peak_mb']:8.1f} MB")
+
+    startup, slow_startup = {}, []
+    if args.startup:
+        startup = measure_startup([None] + list(COMMANDS), args.repeat)
+        for command, seconds in startup.items():
+            print(f'{"startup " + command:>24} | {seconds:8.3f}s (budget {args.startup_budget:.2f}s)')
+            if seconds > args.startup_budget:
+                slow_startup.append(f'startup {command}: {seconds:.3f}s, budget {args.startup_budget:.2f}s')
+
+    with open(args.results, 'w') as f:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                   'tokens': args.tokens, 'words': args.words, 'results': results, 'startup': startup}, f, indent=2)
+    print(f'Saved {args.results}')
+    for regression in slow_startup:
+        print(f'REGRESSION {regression}')
+    if not results:
+        return 1 if slow_startup else 0
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved baseline {args.baseline}')
+        return 1 if slow_startup else 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --save_baseline to store one.')
+        return 1 if slow_startup else 0
+    with open(args.baseline, 'r') as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if not regressions:
+        print(f'No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).')
+    return 1 if regressions or slow_startup else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--stages', nargs='*', choices=STAGES, default=STAGES,
+                        help='Stages to benchmark; none with --startup to only measure start-up')
+    parser.add_argument('--tokens', type=int, default=100000, help='Corpus tokens at scale 1')
+    parser.add_argument('--words', type=int, default=5000, help='Words for make_dataframe and predict at scale 1')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage (best is kept)')
+    parser.add_argument('--data_dir', default='benchmark_data', help='Where synthetic inputs are generated')
+    parser.add_argument('--results', default=RESULTS_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save_baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown / memory growth')
+    parser.add_argument('--startup', action='store_true', help='Also measure the start-up time of the lcp commands')
+    parser.add_argument('--startup_budget', type=float, default=STARTUP_BUDGET,
+                        help='Allowed start-up time per command (seconds)')
+    args = parser.parse_args()
+    if not args.stages and not args.startup:
+        parser.error('nothing to benchmark: give --stages or --startup')
+    if not args.stages and args.save_baseline:
+        parser.error('--save_baseline needs stage results, give --stages')
+
+    sys.exit(main(args))
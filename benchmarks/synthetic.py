@@ -0,0 +1,196 @@
+'''
+Synthetic inputs for the benchmarks, shaped like the real ones (which are not in the repo).
+
+Usage:
+python synthetic.py --out_dir synthetic --tokens 1000000
+
+Output:
+    Texts/{A,B,...}/{A}0/*.xml  BNC-style TEI XML (bncDoc, teiHeader, s/w/c with hw/pos/c5)
+    cefr_wordlist.json          CEFR wordlist ({word: [{'pos', 'level'}]})
+    extended_wordlist.csv       extended wordlist (headword, pos, CEFR)
+    word_features.csv           feature file with a 'word' column
+    wordlist.txt                words to extract features for
+    train_features.csv          training feature file (word, features, score)
+
+Lemma frequencies follow a Zipf distribution, so lookups and groupings see
+a realistic mix of frequent and rare keys. Everything is seeded.
+'''
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+# (BNC POS, c5, CEFR wordlist POS, extended wordlist POS); None means never in the wordlist
+POS_TAGS = [
+    ('SUBST', 'NN1', 'noun', 'noun'),
+    ('SUBST', 'NN2', 'noun', 'noun'),
+    ('VERB', 'VVB', 'verb', 'verb'),
+    ('VERB', 'VVD', 'verb', 'verb'),
+    ('VERB', 'VVG', 'verb', 'verb'),
+    ('ADJ', 'AJ0', 'adjective', 'adjective'),
+    ('ADV', 'AV0', 'adverb', 'adverb'),
+    ('PREP', 'PRP', 'preposition', 'preposition'),
+    ('PRON', 'PNP', 'pronoun', None),
+    ('ART', 'AT0', 'determiner', 'determiner'),
+    ('CONJ', 'CJC', 'conjunction', 'conjunction'),
+    ('INTERJ', 'ITJ', 'exclamation', 'interjection'),
+    ('SUBST', 'NP0', None, None),
+    ('UNC', 'UNC', None, None),
+]
+POS_WEIGHTS = [20, 8, 10, 6, 4, 10, 8, 10, 6, 8, 5, 1, 3, 1]
+PUNCTUATION = [('.', 'PUN'), (',', 'PUN'), ('?', 'PUN'), ('"', 'PUQ'), ('(', 'PUL'), (')', 'PUR')]
+CEFR_LEVELS = ['A1', 'A2', 'B1', 'B2', 'C1', 'C2']
+LETTERS = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+
+def make_vocabulary(n_lemmas, seed=777):
+    '''
+    DataFrame of n_lemmas unique (Lemma, POS, c5) entries with a Zipf sampling probability.
+    '''
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(2, 12, size=n_lemmas * 2)
+    lemmas = pd.Series([''.join(rng.choice(LETTERS, n)) for n in lengths])
+    lemmas = pd.unique(lemmas[~lemmas.isin(['nan', 'null'])])[:n_lemmas]  # read_csv would parse these as NaN
+    tags = rng.choice(len(POS_TAGS), size=len(lemmas), p=np.array(POS_WEIGHTS) / sum(POS_WEIGHTS))
+
+    vocab = pd.DataFrame({
+        'Lemma': lemmas,
+        'POS': [POS_TAGS[t][0] for t in tags],
+        'c5': [POS_TAGS[t][1] for t in tags],
+        'cefr_pos': [POS_TAGS[t][2] for t in tags],
+        'extended_pos': [POS_TAGS[t][3] for t in tags],
+    })
+    rank = np.arange(1, len(vocab) + 1)
+    vocab['p'] = (1 / rank) / (1 / rank).sum()
+    return vocab
+
+
+def header(xml_id, n_tokens):
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<bncDoc xml:id="{xml_id}"><teiHeader><fileDesc><titleStmt><title>Synthetic text {xml_id}</title>'
+            f'<respStmt><resp>Data capture</resp><name>Benchmark</name></respStmt></titleStmt>'
+            f'<extent> {n_tokens} tokens; {n_tokens} w-units; 0 s-units </extent></fileDesc></teiHeader>\n')
+
+
+def write_bnc_file(path, xml_id, vocab, n_sentences, rng):
+    lengths = rng.integers(3, 25, size=n_sentences)
+    picks = rng.choice(len(vocab), size=int(lengths.sum()), p=vocab['p'].to_numpy())
+    lemmas, pos, c5 = vocab['Lemma'].to_numpy(), vocab['POS'].to_numpy(), vocab['c5'].to_numpy()
+
+    body = []
+    offset = 0
+    for n, length in enumerate(lengths, start=1):
+        words = ''.join(f'<w c5="{c5[i]}" hw="{lemmas[i]}" pos="{pos[i]}">{lemmas[i]} </w>'
+                        for i in picks[offset:offset + length])
+        token, tag = PUNCTUATION[n % len(PUNCTUATION)]
+        body.append(f'<s n="{n}">{words}<c c5="{tag}">{token}</c></s>\n')
+        offset += length
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(header(xml_id, offset + n_sentences))
+        f.write('<wtext type="OTHERPUB"><div level="1"><p>\n')
+        f.write(''.join(body))
+        f.write('</p></div></wtext></bncDoc>\n')
+    return int(offset + n_sentences)
+
+
+def write_bnc_corpus(texts_dir, vocab, n_tokens, n_dirs=3, files_per_dir=4, seed=777):
+    '''
+    Writes about n_tokens tokens spread over n_dirs directories (A, B, ...) of files_per_dir files each.
+    Returns the number of tokens written.
+    '''
+    rng = np.random.default_rng(seed)
+    n_sentences = max(1, n_tokens // (15 * n_dirs * files_per_dir))  # sentences average 15 tokens
+    total = 0
+    for d in 'ABCDEFGHJK'[:n_dirs]:
+        os.makedirs(os.path.join(texts_dir, d, f'{d}0'), exist_ok=True)
+        for k in range(files_per_dir):
+            xml_id = f'{d}{k:02d}'
+            total += write_bnc_file(os.path.join(texts_dir, d, f'{d}0', f'{xml_id}.xml'), xml_id, vocab, n_sentences, rng)
+    return total
+
+
+def write_cefr_wordlists(out_dir, vocab, coverage=0.7, extended_coverage=0.15, seed=777):
+    '''
+    Puts a coverage fraction of the taggable lemmas in the CEFR wordlist (some with several levels)
+    and the next extended_coverage fraction in the extended wordlist. The rest is tagged UNK.
+    '''
+    rng = np.random.default_rng(seed)
+    draw = rng.random(len(vocab))
+    levels = rng.choice(CEFR_LEVELS, size=(len(vocab), 2))
+
+    wordlist = {}
+    extended = []
+    for i, row in enumerate(vocab.itertuples()):
+        if pd.notna(row.cefr_pos) and draw[i] < coverage:
+            entries = [{'pos': row.cefr_pos, 'level': levels[i, 0]}]
+            if draw[i] < coverage * 0.2:  # several senses with different levels
+                entries.append({'pos': row.cefr_pos, 'level': levels[i, 1]})
+            wordlist.setdefault(row.Lemma, []).extend(entries)
+        elif pd.notna(row.extended_pos) and draw[i] < coverage + extended_coverage:
+            extended.append((row.Lemma, row.extended_pos, levels[i, 0]))
+
+    cefr_path = os.path.join(out_dir, 'cefr_wordlist.json')
+    with open(cefr_path, 'w') as f:
+        json.dump(wordlist, f)
+    extended_path = os.path.join(out_dir, 'extended_wordlist.csv')
+    pd.DataFrame(extended, columns=['headword', 'pos', 'CEFR']).to_csv(extended_path, index=False)
+    return cefr_path, extended_path
+
+
+def write_feature_files(out_dir, vocab, n_words, n_features=5, seed=777):
+    '''
+    A feature file covering most of the vocabulary, a wordlist of n_words words (some not in the
+    feature file) and a training feature file with scores. Returns the three paths.
+    '''
+    rng = np.random.default_rng(seed)
+    covered = vocab['Lemma'][rng.random(len(vocab)) < 0.9]
+    features = pd.DataFrame(rng.random((len(covered), n_features)), columns=[f'feature_{i}' for i in range(n_features)])
+    features.insert(0, 'word', covered.to_numpy())
+    feature_path = os.path.join(out_dir, 'word_features.csv')
+    features.to_csv(feature_path, index=False)
+
+    words = rng.choice(vocab['Lemma'].to_numpy(), size=n_words, p=vocab['p'].to_numpy())
+    wordlist_path = os.path.join(out_dir, 'wordlist.txt')
+    with open(wordlist_path, 'w') as f:
+        f.write('\n'.join(words))
+
+    train = pd.DataFrame(rng.random((n_words, n_features)), columns=[f'feature_{i}' for i in range(n_features)])
+    train.insert(0, 'word', words)
+    train['score'] = train.iloc[:, 1:].to_numpy() @ rng.random(n_features) + rng.normal(0, 0.1, n_words)
+    train_path = os.path.join(out_dir, 'train_features.csv')
+    train.to_csv(train_path, index=False)
+    return feature_path, wordlist_path, train_path
+
+
+def generate(out_dir, n_tokens, n_lemmas=20000, n_words=5000, n_dirs=3, files_per_dir=4, seed=777):
+    os.makedirs(out_dir, exist_ok=True)
+    vocab = make_vocabulary(n_lemmas, seed)
+    written = write_bnc_corpus(os.path.join(out_dir, 'Texts'), vocab, n_tokens, n_dirs, files_per_dir, seed)
+    cefr_path, extended_path = write_cefr_wordlists(out_dir, vocab, seed=seed)
+    feature_path, wordlist_path, train_path = write_feature_files(out_dir, vocab, n_words, seed=seed)
+    return {
+        'texts_dir': os.path.join(out_dir, 'Texts'),
+        'n_tokens': written,
+        'cefr_wordlist': cefr_path,
+        'extended_wordlist': extended_path,
+        'feature_file': feature_path,
+        'wordlist': wordlist_path,
+        'train_features': train_path,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out_dir', default='synthetic')
+    parser.add_argument('--tokens', type=int, default=1000000, help='Approximate corpus size in tokens')
+    parser.add_argument('--lemmas', type=int, default=20000, help='Vocabulary size')
+    parser.add_argument('--words', type=int, default=5000, help='Words in the feature extraction wordlist')
+    parser.add_argument('--dirs', type=int, default=3, help='Corpus directories (A, B, ...)')
+    parser.add_argument('--files_per_dir', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=777)
+    args = parser.parse_args()
+
+    paths = generate(args.out_dir, args.tokens, args.lemmas, args.words, args.dirs, args.files_per_dir, args.seed)
+    print(json.dumps(paths, indent=2))
@@ -0,0 +1,123 @@
+
+from filter_unk import sentence_key
+
+from lcp.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Context-aware choice between the CEFR levels of ambiguous (Lemma, POS) keys.
+# tag_cefr_vectorized tags every token with the lowest level of its key (compare_cefr_levels). A disambiguator
+# is then called once per batch and re-decides every token whose key has several levels in the wordlists:
+#   signatures(df, codes, ambiguous)   context signature of every row, vectorized over the batch (-1: no context)
+#   choose(candidates, signatures)     level code for (candidate bitmask, signature) pairs
+# choose only sees the (key, signature) pairs that were not decided before; decisions are cached for the
+# whole run. Rows without context keep the lowest level.
+
+CEFR_ORDER = ['A1', 'A2', 'B1', 'B2', 'C1', 'C2']
+CONTENT_POS = ['SUBST', 'VERB', 'ADJ', 'ADV']
+N_SIGNATURES = 8  # signatures are -1..5, so (entry, signature) pairs are packed as entry * 8 + signature + 1
+
+
+# Bitmask of the levels of a key (bit i = CEFR_ORDER[i]); 0 when the key is UNK
+def candidate_mask(levels):
+    if 'UNK' in levels:
+        return 0
+    mask = 0
+    for level in levels:
+        if level in CEFR_ORDER:
+            mask |= 1 << CEFR_ORDER.index(level)
+    return mask
+
+
+def candidate_bits(masks):
+    return (np.asarray(masks, dtype=np.int64)[:, None] >> np.arange(len(CEFR_ORDER))) & 1
+
+
+# Lowest level of every candidate mask, the compare_cefr_levels rule
+def lowest_level(masks):
+    return np.argmax(candidate_bits(masks), axis=1).astype(np.int8)
+
+
+# Keeps the lowest level (no context); subclasses override signatures and choose.
+# Lexicon entries are numbered as in match_cefr_entries: the lookup Series of the CEFR table, then of the
+# extended table, in order; -1 is a token without an entry.
+class Disambiguator:
+    name = 'min'
+
+    def __init__(self, lexicon):
+        tables = [(lexicon['cefr_table'], lexicon['cefr_candidates'])]
+        if lexicon['extended_cefr_table'] is not None:
+            tables.append((lexicon['extended_cefr_table'], lexicon['extended_cefr_candidates']))
+
+        self.keys, masks, codes = [], [], []
+        for table, candidates in tables:
+            for names, lookup in table.items():
+                self.keys.extend(lookup.index)
+                masks.append(candidates[names].to_numpy(dtype=np.uint8))
+                codes.append(pd.Index(CEFR_ORDER).get_indexer(lookup.to_numpy()))
+        # the trailing element is entry -1
+        self.masks = np.append(np.concatenate(masks), 0).astype(np.uint8)
+        self.codes = np.append(np.concatenate(codes), -1).astype(np.int8)
+        self.ambiguous = candidate_bits(self.masks).sum(axis=1) >= 2
+        self.cache = {}
+        self.stats = {'ambiguous_rows': 0, 'changed_rows': 0, 'decisions': 0}
+
+    def signatures(self, df, codes, ambiguous):
+        return np.full(len(df), -1, dtype=np.int64)
+
+    def choose(self, candidates, signatures):
+        return lowest_level(candidates)
+
+    # CEFR levels of a batch after disambiguation; entries and levels come from tag_cefr_vectorized
+    def __call__(self, df, entries, levels):
+        ambiguous = self.ambiguous[entries]
+        if not ambiguous.any():
+            return levels
+        rows = np.flatnonzero(ambiguous)
+        signatures = self.signatures(df, self.codes[entries], ambiguous)[rows]
+
+        pairs = entries[rows].astype(np.int64) * N_SIGNATURES + signatures + 1
+        unique_pairs, inverse = np.unique(pairs, return_inverse=True)
+        cache_keys = [(self.keys[pair // N_SIGNATURES], pair % N_SIGNATURES - 1) for pair in unique_pairs.tolist()]
+        decided = np.array([self.cache.get(key, -1) for key in cache_keys], dtype=np.int8)
+
+        todo = np.flatnonzero(decided < 0)
+        if len(todo):
+            entry, signature = unique_pairs[todo] // N_SIGNATURES, unique_pairs[todo] % N_SIGNATURES - 1
+            decided[todo] = self.choose(self.masks[entry], signature)
+            self.cache.update(zip([cache_keys[i] for i in todo], decided[todo].tolist()))
+
+        new_levels = np.array(CEFR_ORDER, dtype=object)[decided[inverse.ravel()]]
+        self.stats['ambiguous_rows'] += len(rows)
+        self.stats['changed_rows'] += int((new_levels != levels[rows]).sum())
+        self.stats['decisions'] += len(todo)
+
+        levels = levels.copy()
+        levels[rows] = new_levels
+        return levels
+
+
+# Picks the level closest to the sentence: the signature is the rounded mean level code of the unambiguous
+# content words (CONTENT_POS) of the sentence; ties go to the lower level.
+class SentenceLevelDisambiguator(Disambiguator):
+    name = 'sentence'
+
+    def signatures(self, df, codes, ambiguous):
+        sentence_ids = df.groupby(sentence_key, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+        n_sentences = int(sentence_ids.max()) + 1 if len(df) else 0
+        context = ~ambiguous & (codes >= 0) & df['POS'].isin(CONTENT_POS).to_numpy()
+
+        total = np.bincount(sentence_ids[context], weights=codes[context], minlength=n_sentences)
+        count = np.bincount(sentence_ids[context], minlength=n_sentences)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            level = np.where(count > 0, np.floor(total / count + 0.5), -1).astype(np.int64)
+        return level[sentence_ids]
+
+    def choose(self, candidates, signatures):
+        levels = np.arange(len(CEFR_ORDER))
+        distance = np.where(candidate_bits(candidates) == 1, np.abs(levels - signatures[:, None]), len(CEFR_ORDER))
+        return np.where(signatures >= 0, np.argmin(distance, axis=1), lowest_level(candidates)).astype(np.int8)
+
+
+DISAMBIGUATORS = {cls.name: cls for cls in (Disambiguator, SentenceLevelDisambiguator)}
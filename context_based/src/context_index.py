@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import bisect
+import argparse
+
+from token_store import read_table, FORMATS
+from filter_unk import sentence_key, fnames
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+# Inverted index from (Lemma, POS) to the sentences the lemma occurs in, over the tagged or filtered corpus.
+# Everything is stored as flat arrays and loaded memory-mapped, so a query only touches the pages it needs:
+#   keys.npy                 sorted b'lemma\tPOS' keys (fixed-width bytes)
+#   postings_offsets.npy     CSR offsets: postings of keys[i] are postings_*[offsets[i]:offsets[i + 1]]
+#   postings_sentence.npy    sentence number (into the sentence store), in corpus order within a key
+#   postings_token.npy       position of the token in its sentence
+#   postings_cefr.npy        CEFR level code of the token
+#   sentences.bin            sentence store: the tokens of every sentence joined by tabs (utf-8)
+#   sentence_offsets.npy     byte offsets of every sentence in sentences.bin
+#   sentence_xml.npy, sentence_n.npy, xml_ids.txt   XML_ID and SentenceID of every sentence
+#   sentence_level.npy       highest CEFR level code in the sentence (-1 if no token has a level)
+
+index_dir = 'context_index'
+input_dir = 'bnc_filtered'
+
+CEFR_LEVELS = ['A1', 'A2', 'B1', 'B2', 'C1', 'C2']
+UNK_CODE = -1
+
+
+def cefr_codes(levels):
+    return pd.Index(CEFR_LEVELS).get_indexer(levels).astype(np.int8)  # UNK and missing are -1
+
+
+# Split one directory table into sentences (rows of a sentence are contiguous) and write them to the store.
+# Returns the postings of the table with sentence numbers starting at first_sentence.
+def index_table(df, sentence_file, first_sentence, xml_id_codes):
+    n = len(df)
+    xml_id, sentence_id = df['XML_ID'].to_numpy(), df['SentenceID'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, (xml_id[1:] != xml_id[:-1]) | (sentence_id[1:] != sentence_id[:-1])])
+    bounds = np.r_[starts, n]
+    sentence_of_row = np.repeat(np.arange(len(starts)), np.diff(bounds))
+
+    tokens = df['Token'].fillna('').astype(str).to_numpy()
+    lengths = []
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        data = '\t'.join(tokens[a:b]).encode('utf-8')
+        sentence_file.write(data)
+        lengths.append(len(data))
+
+    codes = cefr_codes(df['CEFR'])
+    sentence_level = np.maximum.reduceat(codes, starts) if n else np.zeros(0, dtype=np.int8)
+
+    xml_ids = df['XML_ID'].iloc[starts].astype(str)
+    sentences = {
+        'length': np.array(lengths, dtype=np.int64),
+        'xml': np.array([xml_id_codes.setdefault(x, len(xml_id_codes)) for x in xml_ids], dtype=np.int32),
+        'n': pd.to_numeric(df['SentenceID'].iloc[starts]).to_numpy(dtype=np.int64),
+        'level': sentence_level.astype(np.int8),
+    }
+
+    has_lemma = df['Lemma'].notna().to_numpy() & df['POS'].notna().to_numpy()
+    postings = {
+        'key': (df['Lemma'].astype(str) + '\t' + df['POS'].astype(str)).to_numpy()[has_lemma],
+        'sentence': (sentence_of_row + first_sentence).astype(np.int32)[has_lemma],
+        'token': (np.arange(n) - starts[sentence_of_row]).astype(np.int32)[has_lemma],
+        'cefr': codes[has_lemma],
+    }
+    return sentences, postings
+
+
+def build_context_index(input_dir, fnames, index_dir, suffix='_filtered', file_format='tsv'):
+    os.makedirs(index_dir, exist_ok=True)
+    xml_id_codes = {}
+    key_codes = {}
+    sentences, postings = [], []
+    n_sentences = 0
+
+    with open(os.path.join(index_dir, 'sentences.bin'), 'wb') as sentence_file:
+        for fname in fnames:
+            input_path = f'{input_dir}/{fname}{suffix}{FORMATS[file_format]}'
+            print(f'Indexing {input_path}...')
+            with stage('index', unit=fname) as record:
+                record.read(input_path)
+                df = read_table(input_path, columns=sentence_key + ['Token', 'POS', 'Lemma', 'CEFR'])
+                table_sentences, table_postings = index_table(df, sentence_file, n_sentences, xml_id_codes)
+
+                # keys are numbered in order of appearance here and sorted once at the end
+                keys, local_codes = np.unique(table_postings.pop('key'), return_inverse=True)
+                key_ids = np.array([key_codes.setdefault(k, len(key_codes)) for k in keys], dtype=np.int32)
+                table_postings['key'] = key_ids[local_codes.ravel()]
+
+                sentences.append(table_sentences)
+                postings.append(table_postings)
+                n_sentences += len(table_sentences['length'])
+                record.rows(rows_in=len(df), rows_out=len(table_sentences['length']))
+
+    # keys sorted as utf-8 bytes, the order in which queries are binary searched
+    keys = np.array([k.encode('utf-8') for k in key_codes], dtype=bytes)
+    order = np.argsort(keys, kind='stable')
+    rank = np.empty(len(keys), dtype=np.int32)
+    rank[order] = np.arange(len(keys), dtype=np.int32)
+
+    posting_keys = rank[np.concatenate([p['key'] for p in postings])] if postings else np.zeros(0, dtype=np.int32)
+    by_key = np.argsort(posting_keys, kind='stable')  # corpus order is kept within a key
+    offsets = np.r_[0, np.cumsum(np.bincount(posting_keys, minlength=len(keys)))].astype(np.int64)
+
+    arrays = {
+        'keys': keys[order],
+        'postings_offsets': offsets,
+        'sentence_offsets': np.r_[0, np.cumsum(np.concatenate([s['length'] for s in sentences] or [[]]))].astype(np.int64),
+    }
+    for name in ('sentence', 'token', 'cefr'):
+        arrays[f'postings_{name}'] = np.concatenate([p[name] for p in postings])[by_key]
+    for name in ('xml', 'n', 'level'):
+        arrays[f'sentence_{name}'] = np.concatenate([s[name] for s in sentences])
+    for name, array in arrays.items():
+        np.save(os.path.join(index_dir, f'{name}.npy'), array)
+
+    with open(os.path.join(index_dir, 'xml_ids.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(xml_id_codes))
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+        json.dump({'fnames': fnames, 'input_dir': os.path.abspath(input_dir), 'suffix': suffix,
+                   'keys': len(keys), 'postings': int(offsets[-1]), 'sentences': n_sentences}, f, indent=1)
+    print(f'Saved context index of {len(keys)} (Lemma, POS) keys, {offsets[-1]} postings '
+          f'and {n_sentences} sentences to {index_dir}.')
+
+
+class ContextIndex:
+    def __init__(self, index_dir):
+        def load(name):
+            return np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r')
+
+        self.keys = load('keys')
+        self.offsets = load('postings_offsets')
+        self.posting_sentence = load('postings_sentence')
+        self.posting_token = load('postings_token')
+        self.posting_cefr = load('postings_cefr')
+        self.sentence_offsets = load('sentence_offsets')
+        self.sentence_xml = load('sentence_xml')
+        self.sentence_n = load('sentence_n')
+        self.sentence_level = load('sentence_level')
+        self.sentences = np.memmap(os.path.join(index_dir, 'sentences.bin'), dtype=np.uint8, mode='r') \
+            if self.sentence_offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+        with open(os.path.join(index_dir, 'xml_ids.txt'), 'r', encoding='utf-8') as f:
+            self.xml_ids = f.read().split('\n')
+
+    # Range of postings of (lemma, pos), or of the lemma with any POS when pos is None
+    def posting_range(self, lemma, pos=None):
+        if pos is not None:
+            key = f'{lemma}\t{pos}'.encode('utf-8')
+            i = bisect.bisect_left(self.keys, key)
+            if i == len(self.keys) or self.keys[i] != key:
+                return 0, 0
+            return int(self.offsets[i]), int(self.offsets[i + 1])
+        prefix = f'{lemma}\t'.encode('utf-8')
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + b'\xff', lo)
+        return int(self.offsets[lo]), int(self.offsets[hi])
+
+    def count(self, lemma, pos=None):
+        lo, hi = self.posting_range(lemma, pos)
+        return hi - lo
+
+    # Posting positions of (lemma, pos), optionally only in sentences whose tokens are all at most max_level
+    def select(self, lemma, pos=None, max_level=None):
+        lo, hi = self.posting_range(lemma, pos)
+        positions = np.arange(lo, hi)
+        if max_level is not None:
+            levels = self.sentence_level[self.posting_sentence[lo:hi]]
+            positions = positions[levels <= CEFR_LEVELS.index(max_level)]
+        return positions
+
+    def context(self, position):
+        sentence = int(self.posting_sentence[position])
+        start, end = self.sentence_offsets[sentence], self.sentence_offsets[sentence + 1]
+        tokens = bytes(self.sentences[start:end]).decode('utf-8').split('\t')
+        token = int(self.posting_token[position])
+        cefr, level = int(self.posting_cefr[position]), int(self.sentence_level[sentence])
+        return {
+            'XML_ID': self.xml_ids[self.sentence_xml[sentence]],
+            'SentenceID': int(self.sentence_n[sentence]),
+            'token_offset': token,
+            'Token': tokens[token],
+            'CEFR': CEFR_LEVELS[cefr] if cefr != UNK_CODE else 'UNK',
+            'sentence_level': CEFR_LEVELS[level] if level != UNK_CODE else 'UNK',
+            'sentence': ''.join(tokens).strip(),
+        }
+
+    def first(self, lemma, pos=None, n=10, max_level=None):
+        return [self.context(p) for p in self.select(lemma, pos, max_level)[:n]]
+
+    def sample(self, lemma, pos=None, n=10, max_level=None, seed=None):
+        positions = self.select(lemma, pos, max_level)
+        if len(positions) > n:
+            positions = np.sort(np.random.default_rng(seed).choice(positions, n, replace=False))
+        return [self.context(p) for p in positions]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--build', action='store_true', help='Build the index from the directory tables')
+    parser.add_argument('--input_dir', default=input_dir)
+    parser.add_argument('--suffix', default='_filtered', help="Table name suffix, '_filtered' or '_tagged'")
+    parser.add_argument('--fnames', nargs='+', default=fnames, help='Directory tables to index')
+    parser.add_argument('--format', choices=list(FORMATS), default='tsv', help='Input format')
+    parser.add_argument('--index_dir', default=index_dir)
+    parser.add_argument('--lemma', default=None, help='Query: lemma to look up')
+    parser.add_argument('--pos', default=None, help='Query: POS (all POS when omitted)')
+    parser.add_argument('--n', type=int, default=10, help='Query: number of contexts')
+    parser.add_argument('--max_level', choices=CEFR_LEVELS, default=None, help='Query: highest CEFR level in the sentence')
+    parser.add_argument('--sample', action='store_true', help='Query: random sample instead of the first contexts')
+    parser.add_argument('--seed', type=int, default=None)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    if args.build:
+        build_context_index(args.input_dir, args.fnames, args.index_dir, args.suffix, args.format)
+    if args.lemma:
+        index = ContextIndex(args.index_dir)
+        start = time.perf_counter()
+        if args.sample:
+            contexts = index.sample(args.lemma, args.pos, args.n, args.max_level, args.seed)
+        else:
+            contexts = index.first(args.lemma, args.pos, args.n, args.max_level)
+        elapsed = time.perf_counter() - start
+        for context in contexts:
+            print(json.dumps(context, ensure_ascii=False))
+        print(f'{len(contexts)} of {index.count(args.lemma, args.pos)} contexts in {elapsed * 1000:.1f} ms')
@@ -0,0 +1,188 @@
+import os
+import pickle
+import argparse
+import functools
+
+from token_store import iter_table, table_columns, FORMATS
+from parse_bnc_xml import map_files
+from filter_unk import fnames
+from manifest import Manifest
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+# Corpus statistics per word as a feature file for FeatureExtractor.extract_from_file.
+# Every directory table is counted chunk by chunk into partial counts ({stats_dir}/{fname}_counts.pkl):
+#   lemma_doc  (word, XML_ID) -> tokens of the lemma in the file
+#   token      word -> tokens with that surface form
+#   cefr       (word, CEFR) -> tokens of the lemma with that tag (tagged tables only)
+#   doc_size   XML_ID -> tokens in the file
+# Partial counts are summed by merge_counts, so directories can be counted in parallel and recounted
+# one at a time. Words are lowercased, as extract_from_file looks them up. Punctuation (POS STOP) is skipped.
+
+input_dir = 'bnc_cefr_tagged'
+stats_dir = 'bnc_stats'
+output_file = 'bnc_stats/corpus_features.csv'
+
+CEFR_LEVELS = ['A1', 'A2', 'B1', 'B2', 'C1', 'C2', 'UNK']
+CHUNKSIZE = 1000000  # rows counted at a time
+STATS_VERSION = 1  # bump when the partial counts change, so directories are recounted
+
+
+def empty_counts():
+    return {
+        'lemma_doc': pd.Series(dtype='int64', index=pd.MultiIndex.from_arrays([[], []], names=['word', 'XML_ID'])),
+        'token': pd.Series(dtype='int64', index=pd.Index([], name='word')),
+        'cefr': pd.Series(dtype='int64', index=pd.MultiIndex.from_arrays([[], []], names=['word', 'CEFR'])),
+        'doc_size': pd.Series(dtype='int64', index=pd.Index([], name='XML_ID')),
+    }
+
+
+def merge_counts(partials):
+    merged = {}
+    for name, empty in empty_counts().items():
+        counts = pd.concat([empty] + [p[name] for p in partials])
+        merged[name] = counts.groupby(level=list(range(counts.index.nlevels)), sort=False).sum().astype('int64')
+    return merged
+
+
+def count_chunk(df):
+    df = df[(df['POS'].astype(str) != 'STOP').to_numpy() & df['Lemma'].notna().to_numpy()]
+    words = df['Lemma'].astype(str).str.lower().rename('word')
+    xml_id = df['XML_ID'].astype(str).rename('XML_ID')
+
+    counts = empty_counts()
+    counts['lemma_doc'] = pd.concat([words, xml_id], axis=1).value_counts(sort=False).astype('int64')
+    counts['token'] = df['Token'].dropna().astype(str).str.strip().str.lower().rename('word').value_counts(sort=False).astype('int64')
+    counts['doc_size'] = xml_id.value_counts(sort=False).astype('int64')
+    if 'CEFR' in df:
+        counts['cefr'] = pd.concat([words, df['CEFR'].astype(str).rename('CEFR')], axis=1).value_counts(sort=False).astype('int64')
+    return counts
+
+
+# Count one directory table and save its partial counts. Runs in a worker process with workers > 1.
+def count_directory(input_path, output_path, chunksize=CHUNKSIZE):
+    with stage('stats', unit=os.path.basename(input_path)) as record:
+        record.read(input_path)
+        counts, pending = empty_counts(), []
+        columns = ['XML_ID', 'Token', 'POS', 'Lemma'] + (['CEFR'] if 'CEFR' in table_columns(input_path) else [])
+        for chunk in iter_table(input_path, columns, chunksize):
+            pending.append(count_chunk(chunk))
+            record.rows(rows_in=len(chunk))
+            # fold chunk counts in once they add up to a chunk, so memory stays bounded
+            if sum(len(p['lemma_doc']) for p in pending) >= chunksize:
+                counts, pending = merge_counts([counts] + pending), []
+        counts = merge_counts([counts] + pending)
+
+        tmp_path = f'{output_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(counts, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, output_path)
+        record.rows(rows_out=len(counts['lemma_doc']))
+        record.wrote(output_path)
+    return output_path
+
+
+def count_directory_unit(unit, chunksize=CHUNKSIZE):
+    _, input_path, output_path = unit
+    return count_directory(input_path, output_path, chunksize)
+
+
+def load_counts(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# Feature table from merged counts. Dispersion is Gries' DP over XML files:
+# 0.5 * sum_i |v_i / f - s_i|, where v_i is the lemma count in file i, f its total and s_i the file's share
+# of the corpus (0 = spread evenly, close to 1 = concentrated in a few files).
+def corpus_features(counts):
+    lemma_doc, doc_size = counts['lemma_doc'], counts['doc_size']
+    total = max(int(doc_size.sum()), 1)
+    words = lemma_doc.index.get_level_values('word')
+
+    lemma_freq = lemma_doc.groupby(level='word').sum()
+    doc_freq = lemma_doc.groupby(level='word').size()
+    share = (doc_size / total).reindex(lemma_doc.index.get_level_values('XML_ID')).to_numpy()
+    deviation = np.abs(lemma_doc.to_numpy() / lemma_freq.reindex(words).to_numpy() - share)
+    covered = pd.Series(share, index=words).groupby(level='word').sum()
+    dispersion = 0.5 * (pd.Series(deviation, index=words).groupby(level='word').sum() + 1 - covered)
+
+    index = lemma_freq.index.union(counts['token'].index)
+    features = pd.DataFrame({
+        'lemma_freq': lemma_freq,
+        'lemma_freq_per_million': lemma_freq / total * 1e6,
+        'log_lemma_freq': np.log10(1 + lemma_freq),
+        'token_freq': counts['token'],
+        'doc_freq': doc_freq,
+        'doc_freq_ratio': doc_freq / max(len(doc_size), 1),
+        'dispersion_dp': dispersion.clip(0, 1),
+    }, index=index)
+    # words only seen as a surface form have no lemma counts
+    features = features.fillna({'dispersion_dp': 1.0}).fillna(0)
+    for c in ('lemma_freq', 'token_freq', 'doc_freq'):
+        features[c] = features[c].astype('int64')
+
+    if len(counts['cefr']):
+        cefr = counts['cefr'].unstack('CEFR', fill_value=0).reindex(columns=CEFR_LEVELS, fill_value=0)
+        cefr = cefr.div(cefr.sum(axis=1), axis=0).add_prefix('cefr_')
+        features = features.join(cefr).fillna({c: 0.0 for c in cefr.columns})
+
+    features = features.sort_values('lemma_freq', ascending=False, kind='stable')
+    features.index.name = 'word'
+    return features.reset_index()
+
+
+def corpus_stats(input_dir, fnames, stats_dir, output_file, suffix='_tagged', file_format='tsv', workers=1,
+                 chunksize=CHUNKSIZE, manifest=None):
+    os.makedirs(stats_dir, exist_ok=True)
+    params = {'version': STATS_VERSION, 'suffix': suffix, 'format': file_format, 'input_dir': os.path.abspath(input_dir),
+              'stats_dir': os.path.abspath(stats_dir)}
+    units = [(fname, f'{input_dir}/{fname}{suffix}{FORMATS[file_format]}', f'{stats_dir}/{fname}_counts.pkl')
+             for fname in fnames]
+
+    todo = []
+    for fname, input_path, output_path in units:
+        if manifest and manifest.is_done('stats', fname, [input_path], output_path, params):
+            print(f'Skipping {input_path}, {output_path} is up to date.')
+        else:
+            todo.append((fname, input_path, output_path))
+
+    # one directory per worker; each worker saves its partial counts, which are merged below
+    count = functools.partial(count_directory_unit, chunksize=chunksize)
+    for (fname, input_path, output_path), _ in zip(todo, map_files(count, todo, workers)):
+        if manifest:
+            manifest.record('stats', fname, [input_path], output_path, params)
+        print(f'Saved {output_path}.')
+
+    with stage('stats_merge', directories=len(units)) as record:
+        counts = merge_counts([load_counts(output_path) for _, _, output_path in units])
+        features = corpus_features(counts)
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        features.to_csv(output_file, index=False)
+        record.rows(rows_in=len(counts['lemma_doc']), rows_out=len(features))
+        record.wrote(output_file)
+    print(f'Saved {output_file} ({len(features)} words, {int(counts["doc_size"].sum())} tokens, '
+          f'{len(counts["doc_size"])} files).')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_dir', default=input_dir)
+    parser.add_argument('--suffix', default='_tagged', help="Table name suffix ('' for parsed tables, '_tagged', '_filtered')")
+    parser.add_argument('--fnames', nargs='+', default=fnames, help='Directory tables to count')
+    parser.add_argument('--format', choices=list(FORMATS), default='tsv', help='Input format')
+    parser.add_argument('--stats_dir', default=stats_dir, help='Where partial counts are saved')
+    parser.add_argument('--output', default=output_file, help='Feature file (csv with a word column)')
+    parser.add_argument('--workers', type=int, default=1, help='Directories counted in parallel')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE, help='Rows counted at a time')
+    parser.add_argument('--manifest', default=None, help='Manifest file; only recount directories whose input changed')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    corpus_stats(args.input_dir, args.fnames, args.stats_dir, args.output, args.suffix, args.format, args.workers,
+                 args.chunksize, Manifest(args.manifest) if args.manifest else None)
@@ -1,4 +1,16 @@
-import pandas as pd
+import os
+import time
+import argparse
+
+from token_store import read_table, write_table, filter_rows, is_parquet, iter_groups, table_columns, rows_for_budget, \
+    TableWriter, FORMATS
+from manifest import Manifest
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
 
 tagged_dir = 'bnc_cefr_tagged'
 save_dir = 'bnc_filtered'
@@ -10,17 +22,141 @@ keep_pairs += [('STOP', c5) for c5 in ['POS', 'PUL', 'PUN', 'PUQ', 'PUR']]
 
 fnames = ["A", "B", "C", "D", "E", "F", "G", "H", "J", "K"]
 
-def filter_unk(tagged_dir, save_dir, fnames):
+# Sentence IDs restart in every XML file, so a sentence is identified by both
+sentence_key = ['XML_ID', 'SentenceID']
+
+
+# 'UNK' tokens whose (POS, c5) pair is not in the keep_pairs
+def unk_mask(df):
+    pos_codes, pos_values = pd.factorize(df['POS'])
+    c5_codes, c5_values = pd.factorize(df['c5'])
+
+    # keep_table[pos, c5] is True for pairs in keep_pairs; the extra last row/column catches missing values (code -1)
+    keep_table = np.zeros((len(pos_values) + 1, len(c5_values) + 1), dtype=bool)
+    pos_index, c5_index = pd.Index(pos_values), pd.Index(c5_values)
+    for pos, c5 in keep_pairs:
+        if pos in pos_index and c5 in c5_index:
+            keep_table[pos_index.get_loc(pos), c5_index.get_loc(c5)] = True
+
+    return (df['CEFR'] == 'UNK').to_numpy() & ~keep_table[pos_codes, c5_codes]
+
+
+# Rows to keep: every sentence that contains an unwanted UNK token is dropped. Returns the mask and counts.
+def filter_unk_mask(df):
+    mask = unk_mask(df)
+
+    sentence_ids = df.groupby(sentence_key, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    n_sentences = int(sentence_ids.max()) + 1 if len(df) else 0
+    unk_per_sentence = np.bincount(sentence_ids[mask], minlength=n_sentences)
+    keep = unk_per_sentence[sentence_ids] == 0
+
+    stats = {
+        'tokens_kept': int(keep.sum()),
+        'tokens_dropped': int((~keep).sum()),
+        'sentences_kept': int((unk_per_sentence == 0).sum()),
+        'sentences_dropped': int((unk_per_sentence > 0).sum()),
+    }
+    return keep, stats
+
+
+def filter_unk_df(df):
+    keep, stats = filter_unk_mask(df)
+    return df[keep], stats
+
+
+# Filter a table chunk by chunk. Chunks end on sentence boundaries (iter_groups), so a sentence that spans
+# two chunks of the file is still kept or dropped as a whole.
+def filter_unk_chunked(input_path, output_path, chunksize, record=None):
+    stats = {'tokens_kept': 0, 'tokens_dropped': 0, 'sentences_kept': 0, 'sentences_dropped': 0}
+    with TableWriter(output_path, table_columns(input_path)) as writer:
+        for n_chunks, df in enumerate(iter_groups(input_path, sentence_key, chunksize=chunksize), 1):
+            df_filtered, chunk_stats = filter_unk_df(df)
+            writer.write(df_filtered)
+            for key, value in chunk_stats.items():
+                stats[key] += value
+            if record:
+                record.rows(rows_in=len(df), rows_out=len(df_filtered))
+                record.progress(n_chunks, what='chunks')
+    return stats
+
+
+def filter_unk(tagged_dir, save_dir, fnames, file_format='tsv', manifest=None, memory_mb=None):
+    params = {'keep_pairs': keep_pairs, 'sentence_key': sentence_key, 'format': file_format,
+              'tagged_dir': os.path.abspath(tagged_dir), 'save_dir': os.path.abspath(save_dir)}
+    for fname in fnames:
+        input_path = f'{tagged_dir}/{fname}_tagged{FORMATS[file_format]}'
+        output_path = f'{save_dir}/{fname}_filtered{FORMATS[file_format]}'
+
+        if manifest and manifest.is_done('filter', fname, [input_path], output_path, params):
+            print(f'Skipping {input_path}, {output_path} is up to date.')
+            continue
+        print(f'Processing {input_path}...')
+
+        with stage('filter', unit=fname, memory_mb=memory_mb) as record:
+            record.read(input_path)
+            if memory_mb:
+                chunksize = rows_for_budget(input_path, memory_mb)
+                stats = filter_unk_chunked(input_path, output_path, chunksize, record)
+                record.fields['chunksize'] = chunksize
+            elif is_parquet(input_path):
+                # Only the columns needed for the mask are loaded; rows are then copied over as they are.
+                df = read_table(input_path, columns=sentence_key + ['POS', 'c5', 'CEFR'])
+                keep, stats = filter_unk_mask(df)
+                filter_rows(input_path, output_path, keep)
+                record.rows(rows_in=len(df), rows_out=stats['tokens_kept'])
+            else:
+                df = read_table(input_path)
+                df_filtered, stats = filter_unk_df(df)
+                write_table(df_filtered, output_path)
+                record.rows(rows_in=len(df), rows_out=stats['tokens_kept'])
+            record.wrote(output_path)
+            record.fields.update(stats)
+
+        print(f"Kept {stats['tokens_kept']} tokens / {stats['sentences_kept']} sentences, "
+              f"dropped {stats['tokens_dropped']} tokens / {stats['sentences_dropped']} sentences.")
+        if manifest:
+            manifest.record('filter', fname, [input_path], output_path, params)
+        print(f"Saved {output_path}.")
+
+
+# Time the previous row-wise filter (keyed on SentenceID only) against filter_unk_df on full directory TSVs.
+def benchmark_filter(tagged_dir, fnames):
     for fname in fnames:
         df = pd.read_csv(f'{tagged_dir}/{fname}_tagged.tsv', sep='\t')
 
-        print(f'Processing {fname}_tagged.tsv...')
-    
-        # 'UNK' but POS and c5 pairs are not in the keep_pairs
+        start = time.perf_counter()
         mask = (df['CEFR'] == 'UNK') & (~df[['POS', 'c5']].apply(tuple, axis=1).isin(keep_pairs))
-
         sentences_to_remove = df.loc[mask, 'SentenceID'].unique()
-        df_filtered = df[~df['SentenceID'].isin(sentences_to_remove)]
+        df_legacy = df[~df['SentenceID'].isin(sentences_to_remove)]
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        df_filtered, stats = filter_unk_df(df)
+        vectorized_time = time.perf_counter() - start
+
+        print(f'{fname}: {len(df)} rows | legacy {legacy_time:.2f}s ({len(df) / max(legacy_time, 1e-9):.0f} rows/sec) | '
+              f'vectorized {vectorized_time:.2f}s ({len(df) / max(vectorized_time, 1e-9):.0f} rows/sec) | '
+              f'speedup x{legacy_time / max(vectorized_time, 1e-9):.1f}')
+        print(f'{fname}: legacy kept {len(df_legacy)} tokens, keyed by (XML_ID, SentenceID) keeps {len(df_filtered)} '
+              f'({stats["sentences_dropped"]} sentences dropped)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tagged_dir', default=tagged_dir)
+    parser.add_argument('--save_dir', default=save_dir)
+    parser.add_argument('--fnames', nargs='+', default=fnames, help='Directory TSVs to filter')
+    parser.add_argument('--format', choices=list(FORMATS), default='tsv', help='Input and output format')
+    parser.add_argument('--manifest', default=None, help='Manifest file; skip files whose inputs did not change')
+    parser.add_argument('--benchmark', action='store_true', help='Compare the legacy and vectorized filters')
+    parser.add_argument('--memory_mb', type=int, default=None,
+                        help='Filter in chunks sized to this memory budget (MB) instead of loading whole files')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
 
-        df_filtered.to_csv(f'{save_dir}/{fname}_filtered.tsv', sep='\t', index=False)
-        print(f"Saved {save_dir}/{fname}_filtered.tsv.")
\ No newline at end of file
+    if args.benchmark:
+        benchmark_filter(args.tagged_dir, args.fnames)
+    else:
+        filter_unk(args.tagged_dir, args.save_dir, args.fnames, file_format=args.format,
+                   manifest=Manifest(args.manifest) if args.manifest else None, memory_mb=args.memory_mb)
@@ -0,0 +1,70 @@
+'''
+Content-hash manifest for incremental, resumable corpus processing.
+
+For every (stage, unit), e.g. ('tag', 'A'), the manifest records a hash of the unit's
+input files, the parameters it ran with and the output it produced. A unit is skipped
+when all of them still match and the output is where the current run writes it, so re-runs only redo changed directories and everything
+downstream of them. The manifest is saved after every finished unit, so a crashed run
+picks up where it stopped. File hashes are cached by (size, mtime), so unchanged files
+are not read again.
+'''
+import os
+import json
+import hashlib
+
+from lcp.hashing import sha256_file
+
+
+def params_hash(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.data = {'files': {}, 'stages': {}}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.data = json.load(f)
+
+    def file_hash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.data['files'].get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        sha = sha256_file(path)
+        self.data['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha}
+        return sha
+
+    # Hash of the list of input files (names and contents), so added or removed files count as a change
+    def inputs_hash(self, input_paths):
+        sha = hashlib.sha256()
+        for path in input_paths:
+            sha.update(os.path.abspath(path).encode())
+            sha.update(self.file_hash(path).encode())
+        return sha.hexdigest()
+
+    def is_done(self, stage, unit, input_paths, output_path, params=None):
+        entry = self.data['stages'].get(stage, {}).get(unit)
+        if entry is None or entry['output'] != os.path.abspath(output_path) or not os.path.exists(entry['output']):
+            return False
+        return (entry['inputs'] == self.inputs_hash(input_paths)
+                and entry['params'] == params_hash(params)
+                and entry['output_sha256'] == self.file_hash(entry['output']))
+
+    def record(self, stage, unit, input_paths, output_path, params=None):
+        self.data['stages'].setdefault(stage, {})[unit] = {
+            'inputs': self.inputs_hash(input_paths),
+            'params': params_hash(params),
+            'output': os.path.abspath(output_path),
+            'output_sha256': self.file_hash(output_path),
+        }
+        self.save()
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp_path, self.path)
@@ -1,73 +1,250 @@
 import xml.etree.ElementTree as ET
-import pandas as pd
 import os
 import glob
-import linecache
 import argparse
+import time
 import pdb
+import functools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from token_store import TableWriter, write_table, encode_batch, FORMATS
+from manifest import Manifest
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
+
+pd = lazy_import('pandas')
 
 root_dir = 'data/raw/download/Texts'  # Root directory path
 extension = '**/*.xml'  # xml extension
 
+COLUMNS = ['XML_ID', 'SentenceID', 'TokenID', 'Token', 'POS', 'Lemma', 'c5']  # output TSV columns
+BATCH_SIZE = 100000  # records per batch in streaming mode
+PENDING_PER_WORKER = 2  # files parsed ahead per worker process in parallel mode
+
+def make_record(xml_id, sentence_id, token_id, element):
+    if element.tag == 'w':
+        return {
+            'XML_ID': xml_id,
+            'SentenceID': sentence_id,
+            'TokenID': token_id,
+            'Token': element.text,
+            'POS': element.attrib.get('pos'),
+            'Lemma': element.attrib.get('hw'),
+            'c5': element.attrib.get('c5')
+        }
+    elif element.tag == 'c': # for stopwords (e.g. punctuations)
+        return {
+            'XML_ID': xml_id,
+            'SentenceID': sentence_id,
+            'TokenID': token_id,
+            'Token': element.text,
+            'POS': 'STOP',
+            'Lemma': element.text,
+            'c5': element.attrib.get('c5')
+        }
+    return None
+
 def parse_bnc_xml(file_path):
     tree = ET.parse(file_path)
     root = tree.getroot()
+    xml_id = os.path.splitext(os.path.basename(file_path))[0]
 
     data = []
     i = 1
     for s in root.iter('s'):
         sentence_id = s.attrib.get('n')
         for element in s:
-            if element.tag == 'w':
-                data.append({
-                    'XML_ID': os.path.splitext(os.path.basename(file_path))[0],  
-                    'SentenceID': sentence_id,
-                    'TokenID': i,
-                    'Token': element.text,
-                    'POS': element.attrib.get('pos'),
-                    'Lemma': element.attrib.get('hw'),
-                    'c5': element.attrib.get('c5')
-                })
-                i += 1
-            elif element.tag == 'c': # for stopwords (e.g. punctuations)
-                data.append({
-                    'XML_ID': os.path.splitext(os.path.basename(file_path))[0],
-                    'SentenceID': sentence_id,
-                    'TokenID': i,
-                    'Token': element.text,
-                    'POS': 'STOP',
-                    'Lemma': element.text,
-                    'c5': element.attrib.get('c5')
-                })
+            record = make_record(xml_id, sentence_id, i, element)
+            if record is not None:
+                data.append(record)
                 i += 1
     return data
 
-def loop_bnc_xml(root_dir, processed_dir="bnc_processed", extension='**/*.xml'):
+# Streaming version of parse_bnc_xml. Yields lists of at most batch_size records
+# (same records as parse_bnc_xml) and drops every element once it is parsed,
+# so memory does not grow with the file size.
+# With align_sentences, batches are only cut at the end of a sentence (so they may exceed batch_size).
+def iterparse_bnc_xml(file_path, batch_size=BATCH_SIZE, align_sentences=False):
+    xml_id = os.path.splitext(os.path.basename(file_path))[0]
+
+    batch = []
+    stack = []  # currently open elements
+    sentence_id = None
+    i = 1
+    for event, element in ET.iterparse(file_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            if element.tag == 's':
+                sentence_id = element.attrib.get('n')
+            continue
+
+        stack.pop()
+        if stack and stack[-1].tag == 's':  # only direct children of <s>, as in parse_bnc_xml
+            record = make_record(xml_id, sentence_id, i, element)
+            if record is not None:
+                batch.append(record)
+                i += 1
+                if not align_sentences and len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        elif element.tag == 's' and align_sentences and len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+        # finished with this element, detach it from its parent
+        if stack:
+            stack[-1].remove(element)
+
+    if batch:
+        yield batch
 
+# Manifest parameters of the parse stage; the output location and format are part of them
+def parse_params(processed_dir, output_format):
+    return {'format': output_format, 'processed_dir': os.path.abspath(processed_dir)}
+
+def loop_bnc_xml(root_dir, processed_dir="bnc_processed", extension='**/*.xml', stream=False, batch_size=BATCH_SIZE, workers=1,
+                 output_format='tsv', manifest=None):
+    if workers > 1:
+        if stream:
+            raise ValueError('stream applies to the serial parser (workers=1); parallel workers parse whole files')
+        loop_bnc_xml_parallel(root_dir, processed_dir, extension, workers, output_format, manifest)
+        return
+
+    params = parse_params(processed_dir, output_format)
     for directory in glob.glob(os.path.join(root_dir, '[A-K]'), recursive=False):  # loop over A-K dir
+        dir_name = os.path.basename(directory)
+        output_path = f'{processed_dir}/{dir_name}{FORMATS[output_format]}'
+        file_paths = glob.glob(os.path.join(directory, extension), recursive=True)
+        if manifest and manifest.is_done('parse', dir_name, file_paths, output_path, params):
+            print(f'Skipping directory {directory}, {output_path} is up to date.')
+            continue
         print(f'Parsing directory {directory}...')
-        dir_data = []
-        for file_path in glob.glob(os.path.join(directory, extension), recursive=True):
-            print(f'Parsing file {file_path}...')
-            dir_data.extend(parse_bnc_xml(file_path))  
 
-        df = pd.DataFrame(dir_data)  
-        dir_name = os.path.basename(directory)  
-        df.to_csv(f'{processed_dir}/{dir_name}.tsv', sep='\t', index=False)  
-        print(f'Saved {processed_dir}/{dir_name}.tsv')
+        with stage('parse', unit=dir_name, files=len(file_paths), stream=stream) as record:
+            if stream:
+                # write each batch as soon as it is parsed instead of keeping the whole directory
+                with TableWriter(output_path, COLUMNS) as writer:
+                    for n, file_path in enumerate(file_paths, start=1):
+                        record.read(file_path)
+                        for batch in iterparse_bnc_xml(file_path, batch_size):
+                            writer.write(pd.DataFrame(batch, columns=COLUMNS))
+                            record.rows(rows_in=len(batch), rows_out=len(batch))
+                        record.progress(n, len(file_paths))
+            else:
+                dir_data = []
+                for n, file_path in enumerate(file_paths, start=1):
+                    record.read(file_path)
+                    data = parse_bnc_xml(file_path)
+                    dir_data.extend(data)
+                    record.rows(rows_in=len(data), rows_out=len(data))
+                    record.progress(n, len(file_paths))
+
+                df = pd.DataFrame(dir_data, columns=COLUMNS)  
+                write_table(df, output_path)  
+            record.wrote(output_path)
+
+        if manifest:
+            manifest.record('parse', dir_name, file_paths, output_path, params)
+        print(f'Saved {output_path}')
+
+# Apply func to every file on a pool of worker processes, yielding results in the order of file_paths.
+# At most max_pending files (default PENDING_PER_WORKER per worker) are submitted and not yet consumed,
+# so finished results do not pile up in memory when the consumer is slower than the workers.
+def map_files(func, file_paths, workers=1, max_pending=None):
+    if workers <= 1:
+        for file_path in file_paths:
+            yield func(file_path)
+        return
+    max_pending = max_pending or PENDING_PER_WORKER * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, file_path))
+        while pending:
+            yield pending.popleft().result()
+
+# Parse one file in a worker process and render it for the output format (encode_batch), so the parent
+# process only appends it to the directory table
+def parse_bnc_xml_encoded(file_path, output_format='tsv'):
+    data = parse_bnc_xml(file_path)
+    return len(data), encode_batch(pd.DataFrame(data, columns=COLUMNS), COLUMNS, output_format)
 
+def report_throughput(label, n_files, n_tokens, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    message = f'{label}: {n_files} files in {elapsed:.1f}s ({n_files / elapsed:.1f} files/sec'
+    if n_tokens is not None:
+        message += f', {n_tokens / elapsed:.0f} tokens/sec'
+    print(message + ')')
+
+# Parallel version of loop_bnc_xml. Files of all directories share one process pool and
+# are written back in glob order, so the output is identical to the serial run.
+# Workers return every file already rendered as TSV text or an Arrow table (parse_bnc_xml_encoded).
+def loop_bnc_xml_parallel(root_dir, processed_dir="bnc_processed", extension='**/*.xml', workers=2, output_format='tsv',
+                          manifest=None):
+    dir_files = [(directory, glob.glob(os.path.join(directory, extension), recursive=True))
+                 for directory in glob.glob(os.path.join(root_dir, '[A-K]'), recursive=False)]
+    params = parse_params(processed_dir, output_format)
+    if manifest:
+        done = [directory for directory, file_paths in dir_files
+                if manifest.is_done('parse', os.path.basename(directory), file_paths,
+                                    f'{processed_dir}/{os.path.basename(directory)}{FORMATS[output_format]}', params)]
+        for directory in done:
+            print(f'Skipping directory {directory}, output is up to date.')
+        dir_files = [(directory, file_paths) for directory, file_paths in dir_files if directory not in done]
+    encode = functools.partial(parse_bnc_xml_encoded, output_format=output_format)
+    results = map_files(encode, [f for _, file_paths in dir_files for f in file_paths], workers)
+
+    start = time.perf_counter()
+    total_files, total_tokens = 0, 0
+    for directory, file_paths in dir_files:
+        print(f'Parsing directory {directory} with {workers} workers...')
+        dir_name = os.path.basename(directory)
+        output_path = f'{processed_dir}/{dir_name}{FORMATS[output_format]}'
+        dir_start = time.perf_counter()
+        n_tokens = 0
+        with stage('parse', unit=dir_name, files=len(file_paths), workers=workers) as record:
+            record.read(*file_paths)
+            with TableWriter(output_path, COLUMNS) as writer:
+                for n, _ in enumerate(file_paths, start=1):
+                    n_rows, batch = next(results)
+                    writer.write_encoded(batch)
+                    n_tokens += n_rows
+                    record.rows(rows_in=n_rows, rows_out=n_rows)
+                    record.progress(n, len(file_paths))
+            record.wrote(output_path)
+        if manifest:
+            manifest.record('parse', dir_name, file_paths, output_path, params)
+        print(f'Saved {output_path}')
+        report_throughput(f'Directory {dir_name}', len(file_paths), n_tokens, time.perf_counter() - dir_start)
+        total_files += len(file_paths)
+        total_tokens += n_tokens
+    report_throughput('Total', total_files, total_tokens, time.perf_counter() - start)
+
+# Reads only the teiHeader: parsing stops at its end tag, so the text body is never read or built.
+# The second line (speech or written text marker) is read from the same file handle.
 def parse_bnc_xml_metadata(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    
-    # Get the second line to check whether speech or written text
-    second_line = linecache.getline(file_path, 2).strip()
+    with open(file_path, 'rb') as f:
+        # Get the second line to check whether speech or written text
+        f.readline()
+        second_line = f.readline().decode('utf-8', errors='replace').strip()
+        f.seek(0)
 
-    title = root.find('.//titleStmt/title')
-    name = root.find('.//titleStmt/respStmt/name')
-    extent = root.find('.//extent') # token counts info
+        root, header = None, None
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            if root is None:
+                root = element  # attributes are complete at its start event
+            if event == 'end' and element.tag == 'teiHeader':
+                header = element
+                break
 
-    xml_id = [v for k, v in root.attrib.items() if 'id' in k]
+    xml_id = [v for k, v in root.attrib.items() if 'id' in k] if root is not None else []
+    title = header.find('.//titleStmt/title') if header is not None else None
+    name = header.find('.//titleStmt/respStmt/name') if header is not None else None
+    extent = header.find('.//extent') if header is not None else None # token counts info
 
     return {
         'xml_id': xml_id[0] if xml_id else None,
@@ -78,24 +255,45 @@ def parse_bnc_xml_metadata(file_path):
     }
 
 
-def loop_bnc_xml_metadata(root_dir, extension='**/*.xml'):
+def loop_bnc_xml_metadata(root_dir, extension='**/*.xml', workers=1):
     metadata = []
 
-    for file_path in glob.glob(os.path.join(root_dir, '[A-K]', extension), recursive=True):  
-        print(f'Parsing file {file_path}...')
-        metadata.append(parse_bnc_xml_metadata(file_path))  
+    file_paths = glob.glob(os.path.join(root_dir, '[A-K]', extension), recursive=True)
+    with stage('metadata', files=len(file_paths), workers=workers) as record:
+        if workers > 1:
+            start = time.perf_counter()
+            metadata = list(map_files(parse_bnc_xml_metadata, file_paths, workers))
+            report_throughput(f'Metadata with {workers} workers', len(file_paths), None, time.perf_counter() - start)
+        else:
+            for n, file_path in enumerate(file_paths, start=1):
+                metadata.append(parse_bnc_xml_metadata(file_path))  
+                record.progress(n, len(file_paths))
+        record.rows(rows_in=len(file_paths), rows_out=len(metadata))
 
-    metadata_df = pd.DataFrame(metadata) 
-    metadata_df.to_csv('data/processed/metadata.tsv', sep='\t', index=False)  
+        metadata_df = pd.DataFrame(metadata) 
+        metadata_df.to_csv('data/processed/metadata.tsv', sep='\t', index=False)  
+        record.wrote('data/processed/metadata.tsv')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--xml', action='store_true', help='Parse XML files')
     parser.add_argument('--metadata', action='store_true', help='Parse into metadata')
+    parser.add_argument('--stream', action='store_true', help='Stream XML parsing and write output in batches')
+    parser.add_argument('--batch_size', type=int, default=None, help=f'Records per batch in streaming mode (default {BATCH_SIZE})')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--format', choices=list(FORMATS), default='tsv', help='Output format')
+    parser.add_argument('--manifest', default=None, help='Manifest file; skip directories whose inputs did not change')
+    add_arguments(parser)
     args = parser.parse_args()
+    if args.workers > 1 and (args.stream or args.batch_size is not None):
+        parser.error('--stream and --batch_size apply to the serial parser; use them with --workers 1')
+    if args.batch_size is not None and not args.stream:
+        parser.error('--batch_size requires --stream')
+    configure_from_args(args)
 
     if args.xml:
-        loop_bnc_xml(root_dir)
+        loop_bnc_xml(root_dir, stream=args.stream, batch_size=args.batch_size or BATCH_SIZE, workers=args.workers,
+                     output_format=args.format, manifest=Manifest(args.manifest) if args.manifest else None)
     elif args.metadata:
-        loop_bnc_xml_metadata(root_dir, extension) 
\ No newline at end of file
+        loop_bnc_xml_metadata(root_dir, extension, workers=args.workers) 
\ No newline at end of file
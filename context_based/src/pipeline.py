@@ -0,0 +1,122 @@
+import os
+import glob
+import time
+import argparse
+from contextlib import ExitStack
+
+from parse_bnc_xml import iterparse_bnc_xml, COLUMNS, BATCH_SIZE
+from tag_cefr import load_cefr_lexicon, tag_cefr_vectorized
+from cefr_disambiguation import DISAMBIGUATORS
+from filter_unk import filter_unk_df, keep_pairs, sentence_key
+from token_store import TableWriter, FORMATS
+from manifest import Manifest
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+root_dir = 'data/raw/download/Texts'  # Root directory path
+extension = '**/*.xml'  # xml extension
+
+
+# Parse -> tag -> filter in a single pass over the XML files. Sentence-aligned batches go through
+# CEFR tagging and UNK filtering in memory and only {save_dir}/{dir}_filtered.tsv is written.
+# Pass processed_dir / cefr_tagged_dir to also write the intermediate tables (for debugging).
+def run_pipeline(root_dir, cefr_wordlist_path, extended_wordlist_path, save_dir, extension='**/*.xml',
+                 batch_size=BATCH_SIZE, lexicon_cache=None, processed_dir=None, cefr_tagged_dir=None,
+                 output_format='tsv', manifest=None, disambiguator=None):
+    with stage('lexicon'):
+        lexicon = load_cefr_lexicon(cefr_wordlist_path, extended_wordlist_path, lexicon_cache)
+    cefr_table, extended_cefr_table = lexicon['cefr_table'], lexicon['extended_cefr_table']
+    # batches hold whole sentences, as the disambiguator needs
+    disambiguate = DISAMBIGUATORS[disambiguator](lexicon) if disambiguator else None
+    # the debugging tables are part of the parameters, so asking for them re-runs the directories
+    params = {'lexicon': lexicon['fingerprint'], 'keep_pairs': keep_pairs, 'sentence_key': sentence_key,
+              'format': output_format, 'save_dir': os.path.abspath(save_dir),
+              'processed_dir': os.path.abspath(processed_dir) if processed_dir else None,
+              'tagged_dir': os.path.abspath(cefr_tagged_dir) if cefr_tagged_dir else None}
+    if disambiguator:
+        params['disambiguator'] = disambiguator
+
+    for directory in glob.glob(os.path.join(root_dir, '[A-K]'), recursive=False):  # loop over A-K dir
+        dir_name = os.path.basename(directory)
+        ext = FORMATS[output_format]
+        output_path = f'{save_dir}/{dir_name}_filtered{ext}'
+        file_paths = glob.glob(os.path.join(directory, extension), recursive=True)
+        if manifest and manifest.is_done('pipeline', dir_name, file_paths, output_path, params):
+            print(f'Skipping directory {directory}, {output_path} is up to date.')
+            continue
+
+        print(f'Processing directory {directory}...')
+        start = time.perf_counter()
+        stats = {'tokens_kept': 0, 'tokens_dropped': 0, 'sentences_kept': 0, 'sentences_dropped': 0}
+
+        with stage('pipeline', unit=dir_name, files=len(file_paths)) as record:
+            with ExitStack() as exit_stack:
+                filtered_writer = exit_stack.enter_context(TableWriter(output_path, COLUMNS + ['CEFR']))
+                processed_writer = exit_stack.enter_context(
+                    TableWriter(f'{processed_dir}/{dir_name}{ext}', COLUMNS)) if processed_dir else None
+                tagged_writer = exit_stack.enter_context(
+                    TableWriter(f'{cefr_tagged_dir}/{dir_name}_tagged{ext}', COLUMNS + ['CEFR'])) if cefr_tagged_dir else None
+
+                for n, file_path in enumerate(file_paths, start=1):
+                    record.read(file_path)
+                    for batch in iterparse_bnc_xml(file_path, batch_size, align_sentences=True):
+                        df = pd.DataFrame(batch, columns=COLUMNS)
+                        with record.timer('write'):
+                            if processed_writer:
+                                processed_writer.write(df)
+
+                        with record.timer('tag'):
+                            df['CEFR'] = tag_cefr_vectorized(df, cefr_table, extended_cefr_table, disambiguate)
+                        with record.timer('write'):
+                            if tagged_writer:
+                                tagged_writer.write(df)
+
+                        with record.timer('filter'):
+                            df_filtered, batch_stats = filter_unk_df(df)
+                        with record.timer('write'):
+                            filtered_writer.write(df_filtered)
+                        for k, v in batch_stats.items():
+                            stats[k] += v
+                        record.rows(rows_in=len(df), rows_out=len(df_filtered))
+                    record.progress(n, len(file_paths))
+
+            # the rest of the fused pass is XML parsing
+            record.fields['parse_s'] = (time.perf_counter() - record.started
+                                        - sum(record.fields.get(f'{step}_s', 0.0) for step in ('tag', 'filter', 'write')))
+            record.fields.update(stats)
+            record.wrote(output_path)
+
+        if manifest:
+            manifest.record('pipeline', dir_name, file_paths, output_path, params)
+        elapsed = time.perf_counter() - start
+        n_tokens = stats['tokens_kept'] + stats['tokens_dropped']
+        print(f"Kept {stats['tokens_kept']} tokens / {stats['sentences_kept']} sentences, "
+              f"dropped {stats['tokens_dropped']} tokens / {stats['sentences_dropped']} sentences.")
+        print(f'Saved {output_path} ({n_tokens / max(elapsed, 1e-9):.0f} tokens/sec).')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root_dir', default=root_dir)
+    parser.add_argument('--cefr_wordlist', default='cefr/amer_word_single_entry.json', help='CEFR wordlist (json)')
+    parser.add_argument('--extended_wordlist', default=None, help='Extended CEFR wordlist (csv)')
+    parser.add_argument('--lexicon_cache', default='cefr/cefr_lexicon.pkl', help='Compiled CEFR lexicon cache')
+    parser.add_argument('--save_dir', default='bnc_filtered')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE, help='Tokens per batch (rounded up to whole sentences)')
+    parser.add_argument('--processed_dir', default=None, help='Also write parsed TSVs here (debugging)')
+    parser.add_argument('--tagged_dir', default=None, help='Also write tagged TSVs here (debugging)')
+    parser.add_argument('--format', choices=list(FORMATS), default='tsv', help='Output format')
+    parser.add_argument('--manifest', default=None, help='Manifest file; skip directories whose inputs did not change')
+    parser.add_argument('--disambiguator', choices=list(DISAMBIGUATORS), default=None,
+                        help='Re-decide keys with several CEFR levels in sentence context (default: lowest level)')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    run_pipeline(args.root_dir, args.cefr_wordlist, args.extended_wordlist, args.save_dir, extension,
+                 batch_size=args.batch_size, lexicon_cache=args.lexicon_cache,
+                 processed_dir=args.processed_dir, cefr_tagged_dir=args.tagged_dir, output_format=args.format,
+                 manifest=Manifest(args.manifest) if args.manifest else None, disambiguator=args.disambiguator)
@@ -1,7 +1,24 @@
-import pandas as pd
 import json
+import time
+import argparse
+import hashlib
+import pickle
+import os
 import pdb
 
+from token_store import read_table, write_table, add_column, is_parquet, iter_table, iter_groups, table_columns, \
+    rows_for_budget, TableWriter, FORMATS
+from manifest import Manifest
+from filter_unk import sentence_key
+from cefr_disambiguation import DISAMBIGUATORS, candidate_mask
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.hashing import sha256_file
+from lcp.lazy import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
 
 # Conversion dictionary
 conversion_dict = {
@@ -138,7 +155,8 @@ def compare_cefr_levels(levels):
         return "UNK"
     # Order of CEFR levels from lowest to highest.
     order = ['A1', 'A2', 'B1', 'B2', 'C1', 'C2']
-    # Find and return the lowest level. => Insert WSD module here
+    # Find and return the lowest level. Tokens of keys with several levels can be re-decided
+    # in context by a disambiguator (cefr_disambiguation.py).
     return min(levels, key=order.index)
 
 
@@ -161,47 +179,320 @@ def handle_rows(row, cefr_dict, extended_cefr_dict=None):
     return compare_cefr_levels(level_list)
 
 
-def tag_cefr_level(cefr_wordlist_path, extended_wordlist_path, fnames, processed_dir, cefr_tagged_dir):
+# Reduce every key to its lowest CEFR level in advance, as compare_cefr_levels would do per row.
+def reduce_cefr_dict(cefr_dict):
+    return {key: compare_cefr_levels(levels) for key, levels in cefr_dict.items()}
+
+
+# Compile a CEFR dictionary into lookup tables keyed by (Lemma, POS) and by (Lemma, POS, c5).
+def compile_cefr_table(cefr_dict):
+    reduced = reduce_cefr_dict(cefr_dict)
+
+    cefr_table = {}
+    for names in (['Lemma', 'POS'], ['Lemma', 'POS', 'c5']):
+        keys = [key for key in reduced if len(key) == len(names)]
+        index = pd.MultiIndex.from_arrays(list(zip(*keys)) or [[]] * len(names), names=names)
+        cefr_table[tuple(names)] = pd.Series([reduced[key] for key in keys], index=index, dtype=object)
+    return cefr_table
+
+
+# Candidate levels of every key of a compiled table, as bitmasks (see candidate_mask), in the same order.
+def compile_cefr_candidates(cefr_dict, cefr_table):
+    return {names: pd.Series([candidate_mask(cefr_dict[key]) for key in lookup.index], index=lookup.index, dtype=np.uint8)
+            for names, lookup in cefr_table.items()}
+
+
+# Entry of every row in the concatenated lookup Series of the tables (-1 when no key matches).
+# Lookup order: (Lemma, POS), (Lemma, POS, c5), then the same keys in the extended table.
+def match_cefr_entries(df, tables):
+    entries = np.full(len(df), -1, dtype=np.int64)
+    missing = np.ones(len(df), dtype=bool)
+
+    # Factorize each key column once and translate its unique values to the codes used in each table,
+    # so every lookup is an integer hash join instead of per-row string hashing.
+    factorized = {name: pd.factorize(df[name]) for name in ('Lemma', 'POS', 'c5')}
+
+    offset = 0
+    for table in tables:
+        for names, lookup in table.items():
+            offset += len(lookup)
+            rows = np.flatnonzero(missing)
+            if len(rows) == 0 or len(lookup) == 0:
+                continue
+            row_keys = np.zeros(len(rows), dtype=np.int64)
+            valid = np.ones(len(rows), dtype=bool)
+            for name, level_values in zip(names, lookup.index.levels):
+                codes, uniques = factorized[name]
+                # missing values (code -1) map to the trailing -1
+                codes = np.append(level_values.get_indexer(uniques), -1)[codes[rows]]
+                valid &= codes >= 0
+                row_keys = row_keys * len(level_values) + codes
+
+            table_keys = np.zeros(len(lookup), dtype=np.int64)
+            for level_values, codes in zip(lookup.index.levels, lookup.index.codes):
+                table_keys = table_keys * len(level_values) + codes
+
+            positions = pd.Index(table_keys).get_indexer(row_keys[valid])
+            found = rows[valid][positions >= 0]
+            entries[found] = offset - len(lookup) + positions[positions >= 0]
+            missing[found] = False
+    return entries
+
+
+# Vectorized equivalent of handle_rows over a whole DataFrame. With a disambiguator, tokens of keys
+# with several levels are re-decided in their sentence context (the batch must hold whole sentences).
+def tag_cefr_vectorized(df, cefr_table, extended_cefr_table=None, disambiguator=None):
+    tables = [cefr_table] + ([extended_cefr_table] if extended_cefr_table else [])
+    entries = match_cefr_entries(df, tables)
+    # entry -1 picks the trailing UNK
+    values = np.concatenate([lookup.to_numpy(dtype=object) for table in tables for lookup in table.values()]
+                            + [np.array(['UNK'], dtype=object)])
+    levels = values[entries]
+    if disambiguator is not None:
+        levels = disambiguator(df, entries, levels)
+    return pd.Series(levels, index=df.index, name='CEFR')
+
+
+# Bump when the way the dictionaries are built changes, so existing lexicon caches are rebuilt.
+LEXICON_CACHE_VERSION = 2
+
+
+# Everything the compiled lexicon depends on: wordlist contents and the conversion tables.
+def lexicon_sources(cefr_wordlist_path, extended_wordlist_path):
+    return {
+        'version': LEXICON_CACHE_VERSION,
+        'cefr_wordlist': {'path': os.path.abspath(cefr_wordlist_path), 'sha256': sha256_file(cefr_wordlist_path)},
+        'extended_wordlist': {'path': os.path.abspath(extended_wordlist_path), 'sha256': sha256_file(extended_wordlist_path)}
+                             if extended_wordlist_path else None,
+        'conversion_dict': conversion_dict,
+        'extended_conversion_dict': extended_conversion_dict,
+        'exception_in_bnc': exception_in_bnc,
+    }
+
+
+# Hash of lexicon_sources that a lexicon cache must match to be reused
+def lexicon_fingerprint(sources):
+    # paths are recorded for reference only; moving an unchanged wordlist keeps the cache valid
+    signature = {k: ({kk: vv for kk, vv in v.items() if kk != 'path'} if isinstance(v, dict) and 'sha256' in v else v)
+                 for k, v in sources.items()}
+    return hashlib.sha256(repr(signature).encode()).hexdigest()
+
+
+# Load the compiled lookup tables from lexicon_cache, rebuilding and saving them
+# when the cache is missing or was built from different wordlists or conversion tables.
+def load_cefr_lexicon(cefr_wordlist_path, extended_wordlist_path=None, lexicon_cache=None):
+    sources = lexicon_sources(cefr_wordlist_path, extended_wordlist_path)
+    fingerprint = lexicon_fingerprint(sources)
+
+    if lexicon_cache and os.path.exists(lexicon_cache):
+        with open(lexicon_cache, 'rb') as f:
+            lexicon = pickle.load(f)
+        if lexicon.get('fingerprint') == fingerprint:
+            print(f'Loaded CEFR lexicon from {lexicon_cache}.')
+            return lexicon
+        print(f'CEFR lexicon in {lexicon_cache} is outdated, rebuilding...')
+
     cefr_dict = create_cefr_dict(cefr_wordlist_path=cefr_wordlist_path)
+    extended_cefr_dict = None
     if extended_wordlist_path:
         extended_cefr_dict = create_cefr_dict_from_extended(cefr_dict.keys(), extended_wordlist_path)
-        
-    for fname in fnames:
-        # load tsv file
-        print(f'Processing {fname}.tsv...')
-        df = pd.read_csv(f'{processed_dir}/{fname}.tsv', sep='\t')
-        print(df.head())
-        if extended_wordlist_path:
-            # Use the dictionary to add a new column 'CEFR' to the DataFrame.
-            df['CEFR'] = df.apply(handle_rows, args=(cefr_dict, extended_cefr_dict), axis=1)
 
+    cefr_table = compile_cefr_table(cefr_dict)
+    extended_cefr_table = compile_cefr_table(extended_cefr_dict) if extended_cefr_dict is not None else None
+    lexicon = {
+        'fingerprint': fingerprint,
+        'sources': sources,
+        'cefr_table': cefr_table,
+        'extended_cefr_table': extended_cefr_table,
+        # every level of every key, for the disambiguators
+        'cefr_candidates': compile_cefr_candidates(cefr_dict, cefr_table),
+        'extended_cefr_candidates': compile_cefr_candidates(extended_cefr_dict, extended_cefr_table)
+                                    if extended_cefr_dict is not None else None,
+    }
+
+    if lexicon_cache:
+        tmp_path = f'{lexicon_cache}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(lexicon, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, lexicon_cache)
+        print(f'Saved CEFR lexicon to {lexicon_cache}.')
+    return lexicon
+
+
+# Row-wise tagging with the original dictionaries, kept as the reference implementation.
+def tag_cefr_rowwise(df, cefr_dict, extended_cefr_dict=None):
+    if extended_cefr_dict is not None:
+        return df.apply(handle_rows, args=(cefr_dict, extended_cefr_dict), axis=1)
+    return df.apply(
+        lambda row: compare_cefr_levels(
+            cefr_dict.get((row['Lemma'], row['POS']), cefr_dict.get((row['Lemma'], row['POS'], row['c5']), ["UNK"]))
+        ), axis=1
+    )
+
+
+def tag_cefr_level(cefr_wordlist_path, extended_wordlist_path, fnames, processed_dir, cefr_tagged_dir, vectorized=True,
+                   lexicon_cache=None, file_format='tsv', manifest=None, memory_mb=None, disambiguator=None):
+    if disambiguator and not vectorized:
+        raise ValueError('A disambiguator needs the vectorized tagger.')
+    # files are re-tagged when their input, the CEFR lexicon, the disambiguator or the output location changed
+    params = {'lexicon': lexicon_fingerprint(lexicon_sources(cefr_wordlist_path, extended_wordlist_path)),
+              'format': file_format, 'processed_dir': os.path.abspath(processed_dir),
+              'tagged_dir': os.path.abspath(cefr_tagged_dir)}
+    if disambiguator:
+        params['disambiguator'] = disambiguator
+    if manifest and all(manifest.is_done('tag', fname, [f'{processed_dir}/{fname}{FORMATS[file_format]}'],
+                                         f'{cefr_tagged_dir}/{fname}_tagged{FORMATS[file_format]}', params)
+                        for fname in fnames):
+        print('All files are already tagged.')
+        return
+
+    with stage('lexicon', vectorized=vectorized):
+        if vectorized:
+            lexicon = load_cefr_lexicon(cefr_wordlist_path, extended_wordlist_path, lexicon_cache)
+            cefr_table, extended_cefr_table = lexicon['cefr_table'], lexicon['extended_cefr_table']
+            disambiguate = DISAMBIGUATORS[disambiguator](lexicon) if disambiguator else None
         else:
-            # Use the dictionary to add a new column 'CEFR' to the DataFrame.
-            df['CEFR'] = df.apply(
-                lambda row: compare_cefr_levels(
-                    cefr_dict.get((row['Lemma'], row['POS']), cefr_dict.get((row['Lemma'], row['POS'], row['c5']), ["UNK"]))
-                ), axis=1
-            )
-
-        df.to_csv(f'{cefr_tagged_dir}/{fname}_tagged.tsv', sep='\t', index=False)
-        print(f'Saved {cefr_tagged_dir}/{fname}_tagged.tsv.')
-    
+            cefr_dict = create_cefr_dict(cefr_wordlist_path=cefr_wordlist_path)
+            extended_cefr_dict = None
+            if extended_wordlist_path:
+                extended_cefr_dict = create_cefr_dict_from_extended(cefr_dict.keys(), extended_wordlist_path)
 
-if __name__ == '__main__':
-    fnames = ["A"]
-    cefr_dict = create_cefr_dict(cefr_wordlist_path='cefr/amer_word_single_entry.json')
+    for fname in fnames:
+        input_path = f'{processed_dir}/{fname}{FORMATS[file_format]}'
+        output_path = f'{cefr_tagged_dir}/{fname}_tagged{FORMATS[file_format]}'
+        if manifest and manifest.is_done('tag', fname, [input_path], output_path, params):
+            print(f'Skipping {input_path}, {output_path} is up to date.')
+            continue
+        print(f'Processing {input_path}...')
+
+        with stage('tag', unit=fname, vectorized=vectorized, memory_mb=memory_mb, disambiguator=disambiguator) as record:
+            record.read(input_path)
+            disambiguated = dict(disambiguate.stats) if disambiguator else None
+            if memory_mb:
+                # Chunks are sized to the memory budget and appended to the output as soon as they are tagged.
+                # The disambiguator looks at whole sentences, so its chunks end on sentence boundaries.
+                chunksize = rows_for_budget(input_path, memory_mb)
+                chunks = iter_groups(input_path, sentence_key, chunksize=chunksize) if disambiguator \
+                    else iter_table(input_path, chunksize=chunksize)
+                unk_rows = 0
+                with TableWriter(output_path, table_columns(input_path) + ['CEFR']) as writer:
+                    for n_chunks, df in enumerate(chunks, 1):
+                        if vectorized:
+                            levels = tag_cefr_vectorized(df, cefr_table, extended_cefr_table, disambiguate)
+                        else:
+                            levels = tag_cefr_rowwise(df, cefr_dict, extended_cefr_dict)
+                        df['CEFR'] = levels
+                        writer.write(df)
+                        unk_rows += int((levels == 'UNK').sum())
+                        record.rows(rows_in=len(df), rows_out=len(df))
+                        record.progress(n_chunks, what='chunks')
+                record.wrote(output_path)
+                record.fields.update({'unk_rows': unk_rows, 'chunksize': chunksize})
+            elif vectorized and is_parquet(input_path):
+                # Only the key columns are loaded; the other columns are copied over as they are.
+                df = read_table(input_path, columns=['Lemma', 'POS', 'c5'] + (sentence_key if disambiguator else []))
+                levels = tag_cefr_vectorized(df, cefr_table, extended_cefr_table, disambiguate)
+                add_column(input_path, output_path, 'CEFR', levels.to_numpy())
+                record.rows(rows_in=len(df), rows_out=len(df))
+                record.wrote(output_path)
+                record.fields['unk_rows'] = int((levels == 'UNK').sum())
+            else:
+                df = read_table(input_path)
+
+                # Use the dictionary to add a new column 'CEFR' to the DataFrame.
+                if vectorized:
+                    levels = tag_cefr_vectorized(df, cefr_table, extended_cefr_table, disambiguate)
+                else:
+                    levels = tag_cefr_rowwise(df, cefr_dict, extended_cefr_dict)
+                df['CEFR'] = levels
+
+                write_table(df, output_path)
+                record.rows(rows_in=len(df), rows_out=len(df))
+                record.wrote(output_path)
+                record.fields['unk_rows'] = int((levels == 'UNK').sum())
+            if disambiguator:
+                record.fields.update({k: v - disambiguated[k] for k, v in disambiguate.stats.items()})
+
+        if manifest:
+            manifest.record('tag', fname, [input_path], output_path, params)
+        print(f'Saved {output_path}.')
+
+
+# Time the row-wise and vectorized taggers on the same files and check that the CEFR columns are identical.
+# The vectorized tagger is also timed with the disambiguator, whose changes are counted rather than checked.
+def benchmark_tagger(cefr_wordlist_path, extended_wordlist_path, fnames, processed_dir, disambiguator='sentence'):
+    cefr_dict = create_cefr_dict(cefr_wordlist_path=cefr_wordlist_path)
+    extended_cefr_dict = None
+    if extended_wordlist_path:
+        extended_cefr_dict = create_cefr_dict_from_extended(cefr_dict.keys(), extended_wordlist_path)
+
+    start = time.perf_counter()
+    cefr_table = compile_cefr_table(cefr_dict)
+    extended_cefr_table = compile_cefr_table(extended_cefr_dict) if extended_cefr_dict is not None else None
+    print(f'Compiled lookup tables in {time.perf_counter() - start:.3f}s')
+    disambiguate = DISAMBIGUATORS[disambiguator]({
+        'cefr_table': cefr_table,
+        'extended_cefr_table': extended_cefr_table,
+        'cefr_candidates': compile_cefr_candidates(cefr_dict, cefr_table),
+        'extended_cefr_candidates': compile_cefr_candidates(extended_cefr_dict, extended_cefr_table)
+                                    if extended_cefr_dict is not None else None,
+    })
 
     for fname in fnames:
-        # load tsv file
-        print(f'Processing {fname}.tsv...')
-        df = pd.read_csv(f'bnc_processed/{fname}.tsv', sep='\t')
-
-        # Use the dictionary to add a new column 'CEFR' to the DataFrame.
-        df['CEFR'] = df.apply(
-            lambda row: compare_cefr_levels(
-                cefr_dict.get((row['Lemma'], row['POS']), cefr_dict.get((row['Lemma'], row['POS'], row['c5']), ["UNK"]))
-            ), axis=1
-        )
-
-        df.to_csv(f'bnc_cefr_tagged/{fname}_tagged.tsv', sep='\t', index=False)
-        print(f'Saved bnc_cefr_tagged/{fname}_tagged.tsv.')
+        df = pd.read_csv(f'{processed_dir}/{fname}.tsv', sep='\t')
+
+        start = time.perf_counter()
+        rowwise = tag_cefr_rowwise(df, cefr_dict, extended_cefr_dict)
+        rowwise_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vectorized = tag_cefr_vectorized(df, cefr_table, extended_cefr_table)
+        vectorized_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        disambiguated = tag_cefr_vectorized(df, cefr_table, extended_cefr_table, disambiguate)
+        disambiguated_time = time.perf_counter() - start
+
+        mismatches = int((rowwise.to_numpy() != vectorized.to_numpy()).sum())
+        changed = int((disambiguated.to_numpy() != vectorized.to_numpy()).sum())
+        print(f'{fname}: {len(df)} rows | row-wise {rowwise_time:.2f}s ({len(df) / max(rowwise_time, 1e-9):.0f} rows/sec) | '
+              f'vectorized {vectorized_time:.2f}s ({len(df) / max(vectorized_time, 1e-9):.0f} rows/sec) | '
+              f'speedup x{rowwise_time / max(vectorized_time, 1e-9):.1f}')
+        print(f'{fname}: {disambiguator} disambiguation {disambiguated_time:.2f}s '
+              f'({len(df) / max(disambiguated_time, 1e-9):.0f} rows/sec) | {changed} of '
+              f'{disambiguate.stats["ambiguous_rows"]} ambiguous rows changed')
+        disambiguate.stats.update(ambiguous_rows=0, changed_rows=0, decisions=0)
+        assert mismatches == 0, f'{fname}: {mismatches} rows tagged differently'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cefr_wordlist', default='cefr/amer_word_single_entry.json', help='CEFR wordlist (json)')
+    parser.add_argument('--extended_wordlist', default=None, help='Extended CEFR wordlist (csv)')
+    parser.add_argument('--fnames', nargs='+', default=["A"], help='Directory TSVs to tag')
+    parser.add_argument('--processed_dir', default='bnc_processed')
+    parser.add_argument('--tagged_dir', default='bnc_cefr_tagged')
+    parser.add_argument('--lexicon_cache', default='cefr/cefr_lexicon.pkl', help='Compiled CEFR lexicon cache')
+    parser.add_argument('--format', choices=list(FORMATS), default='tsv', help='Input and output format')
+    parser.add_argument('--manifest', default=None, help='Manifest file; skip files whose inputs did not change')
+    parser.add_argument('--rowwise', action='store_true', help='Use the row-wise reference tagger')
+    parser.add_argument('--benchmark', action='store_true', help='Compare row-wise and vectorized taggers')
+    parser.add_argument('--disambiguator', choices=list(DISAMBIGUATORS), default=None,
+                        help='Re-decide keys with several CEFR levels in sentence context (default: lowest level)')
+    parser.add_argument('--memory_mb', type=int, default=None,
+                        help='Tag in chunks sized to this memory budget (MB) instead of loading whole files')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    if args.rowwise and args.disambiguator:
+        parser.error('--disambiguator needs the vectorized tagger')
+
+    if args.benchmark:
+        benchmark_tagger(args.cefr_wordlist, args.extended_wordlist, args.fnames, args.processed_dir,
+                         args.disambiguator or 'sentence')
+    else:
+        tag_cefr_level(args.cefr_wordlist, args.extended_wordlist, args.fnames, args.processed_dir, args.tagged_dir,
+                       vectorized=not args.rowwise, lexicon_cache=args.lexicon_cache, file_format=args.format,
+                       manifest=Manifest(args.manifest) if args.manifest else None, memory_mb=args.memory_mb,
+                       disambiguator=args.disambiguator)
@@ -0,0 +1,193 @@
+'''
+Reading and writing token tables as TSV or Parquet.
+
+Parquet files store SentenceID/TokenID as integers and dictionary-encode the string
+columns, so repeated values (POS, c5, Lemma, CEFR, XML_ID) are stored once per row group.
+They are read back as pandas categoricals, and `columns` only loads the requested columns.
+iter_table reads a table in chunks, so memory does not grow with the table size. TSV chunks
+are read with the same compact dtypes (int32 IDs, categorical strings), and rows_for_budget
+sizes the chunks for a memory budget. iter_groups keeps groups such as sentences within one chunk.
+pyarrow is only needed for .parquet paths.
+'''
+import os
+
+from lcp.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+INTEGER_COLUMNS = ['SentenceID', 'TokenID']
+CATEGORICAL_COLUMNS = ['XML_ID', 'POS', 'Lemma', 'c5', 'CEFR']
+FORMATS = {'tsv': '.tsv', 'parquet': '.parquet'}
+COMPACT_DTYPES = {**{c: 'int32' for c in INTEGER_COLUMNS}, **{c: 'category' for c in CATEGORICAL_COLUMNS}}
+SAMPLE_ROWS = 10000  # rows read to estimate the memory of a row
+WORKING_SET_FACTOR = 4  # memory used while processing a chunk, relative to the chunk itself
+
+
+def is_parquet(path):
+    return os.path.splitext(path)[-1] == FORMATS['parquet']
+
+
+def arrow_schema(columns):
+    import pyarrow as pa
+    return pa.schema([(c, pa.int32() if c in INTEGER_COLUMNS else pa.string()) for c in columns])
+
+
+def to_arrow(df):
+    import pyarrow as pa
+    df = df.copy()
+    for c in INTEGER_COLUMNS:
+        if c in df:
+            df[c] = pd.to_numeric(df[c]).astype('int32')
+    for c in df.columns:
+        if c not in INTEGER_COLUMNS:
+            df[c] = df[c].astype(object).where(df[c].notna(), None)
+    return pa.Table.from_pandas(df, schema=arrow_schema(list(df.columns)), preserve_index=False)
+
+
+def read_table(path, columns=None):
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        names = pq.read_schema(path).names
+        read_dictionary = [c for c in CATEGORICAL_COLUMNS if c in names and (columns is None or c in columns)]
+        return pq.read_table(path, columns=columns, read_dictionary=read_dictionary).to_pandas()
+    return pd.read_csv(path, sep='\t', usecols=columns)
+
+
+def table_columns(path):
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return list(pd.read_csv(path, sep='\t', nrows=0).columns)
+
+
+# Read a table in DataFrames of at most chunksize rows (one Parquet batch or TSV chunk at a time)
+def iter_table(path, columns=None, chunksize=1000000):
+    names = table_columns(path)
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        read_dictionary = [c for c in CATEGORICAL_COLUMNS if c in names and (columns is None or c in columns)]
+        for batch in pq.ParquetFile(path, read_dictionary=read_dictionary).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        dtype = {c: t for c, t in COMPACT_DTYPES.items() if c in names and (columns is None or c in columns)}
+        yield from pd.read_csv(path, sep='\t', usecols=columns, dtype=dtype, chunksize=chunksize)
+
+
+# Rows per chunk so that processing a chunk stays within memory_mb, estimated from the first rows of the table
+def rows_for_budget(path, memory_mb, columns=None):
+    sample = next(iter_table(path, columns, SAMPLE_ROWS), None)
+    if sample is None or len(sample) == 0:
+        return SAMPLE_ROWS
+    bytes_per_row = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+    return max(1000, int(memory_mb * 2 ** 20 / (bytes_per_row * WORKING_SET_FACTOR)))
+
+
+# Concatenate two chunks, keeping categorical columns categorical (pd.concat falls back to object
+# when the categories differ)
+def concat_chunks(a, b):
+    a, b = a.copy(), b.copy()
+    for c in a.columns:
+        if isinstance(a[c].dtype, pd.CategoricalDtype) and isinstance(b[c].dtype, pd.CategoricalDtype):
+            categories = a[c].cat.categories.union(b[c].cat.categories)
+            a[c] = a[c].cat.set_categories(categories)
+            b[c] = b[c].cat.set_categories(categories)
+    return pd.concat([a, b], ignore_index=True)
+
+
+# iter_table with chunks that end on a group boundary (e.g. a sentence): rows of a group are contiguous,
+# so the last group of a chunk is held back and yielded with the next chunk.
+def iter_groups(path, key, columns=None, chunksize=1000000):
+    carry = None
+    for df in iter_table(path, columns, chunksize):
+        if carry is not None:
+            df = concat_chunks(carry, df)
+        if len(df) == 0:
+            continue
+        last = np.ones(len(df), dtype=bool)
+        for c in key:
+            values = df[c].to_numpy()
+            last &= values == values[-1]
+        other = np.flatnonzero(~last)
+        start = other[-1] + 1 if len(other) else 0
+        if start:
+            yield df.iloc[:start]
+        carry = df.iloc[start:]
+    if carry is not None and len(carry):
+        yield carry
+
+
+# A batch rendered for file_format (a FORMATS key), so worker processes can do the conversion and the
+# writing process only appends it (TableWriter.write_encoded): TSV text, or an Arrow table for Parquet
+def encode_batch(df, columns, file_format):
+    df = df[columns]
+    if file_format == 'parquet':
+        return to_arrow(df)
+    return df.to_csv(sep='\t', index=False, header=False)
+
+
+def write_table(df, path):
+    with TableWriter(path, list(df.columns)) as writer:
+        writer.write(df)
+
+
+# Append DataFrame batches to a TSV or Parquet file (one row group per batch)
+class TableWriter:
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        if is_parquet(path):
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, arrow_schema(columns))
+            self.f = None
+        else:
+            self.writer = None
+            self.f = open(path, 'w', newline='')
+            pd.DataFrame(columns=columns).to_csv(self.f, sep='\t', index=False)
+
+    def write(self, df):
+        df = df[self.columns]
+        if self.writer is not None:
+            self.writer.write_table(to_arrow(df))
+        else:
+            df.to_csv(self.f, sep='\t', index=False, header=False)
+
+    def write_encoded(self, batch):
+        if self.writer is not None:
+            self.write_arrow(batch)
+        else:
+            self.f.write(batch)
+
+    def write_arrow(self, table):
+        self.writer.write_table(table.select(self.columns).cast(arrow_schema(self.columns)))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Copy the Parquet table at src to dst with an extra column, without converting the other columns to pandas
+def add_column(src, dst, name, values):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pq.read_table(src)
+    table = table.append_column(name, pa.array(values, type=pa.string()))
+    with TableWriter(dst, table.column_names) as writer:
+        writer.write_arrow(table)
+
+
+# Copy the rows of the Parquet table at src where keep is True to dst
+def filter_rows(src, dst, keep):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pq.read_table(src).filter(pa.array(keep))
+    with TableWriter(dst, table.column_names) as writer:
+        writer.write_arrow(table)
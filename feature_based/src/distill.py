@@ -0,0 +1,141 @@
+'''
+Usage (from feature_based/src, after pip install -e . at the repository root, see README.md):
+python distill.py [--teacher AutoMLRegressor.pkl] [--output DistilledRegressor.pkl] [--feature_file original_features.csv]
+
+Input: feature list used in training, Trained AutoSklearn ensemble (teacher)
+Output: a single scikit-learn model (student) that loads without auto-sklearn,
+        and a report comparing load time, prediction latency and accuracy of both models
+
+The student is fit on a blend of the gold scores and the teacher's predictions
+(alpha * teacher + (1 - alpha) * gold). Optional unlabeled feature rows are labeled
+by the teacher and added to the student's training data. Candidates are compared on
+a validation split of the training data and the best one is refit and saved.
+'''
+import json
+import time
+import pickle
+import argparse
+# scikit-learn is imported in the functions that use it, as it takes seconds to import
+
+from evaluate import load_data, load_model, compute_metrics, FEATURE_FILE, MODEL_NAME
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+STUDENT_NAME = 'DistilledRegressor.pkl'
+REPORT_FILE = 'distill_report.json'
+
+
+def candidate_models():
+    '''
+    Unfitted student models, compared on the validation split.
+    '''
+    from sklearn.ensemble import HistGradientBoostingRegressor
+    from sklearn.linear_model import Ridge
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    return {
+        'hist_gradient_boosting': HistGradientBoostingRegressor(random_state=777),
+        'ridge': make_pipeline(StandardScaler(), Ridge()),
+    }
+
+
+def timed_load(model_name):
+    start = time.perf_counter()
+    model = load_model(model_name)
+    return model, time.perf_counter() - start
+
+
+def prediction_latency(model, x, repeats=20):
+    # per-row latency in a batch, and latency of single-row calls (as in online serving)
+    start = time.perf_counter()
+    model.predict(x)
+    batch_per_row = (time.perf_counter() - start) / len(x)
+
+    single = []
+    for row in x[:repeats]:
+        start = time.perf_counter()
+        model.predict(row.reshape(1, -1))
+        single.append(time.perf_counter() - start)
+    return {'batch_ms_per_row': batch_per_row * 1000, 'single_row_ms': float(np.median(single)) * 1000}
+
+
+def distill(teacher, x_train, y_train, alpha=0.5, x_unlabeled=None):
+    from sklearn.base import clone
+    from sklearn.model_selection import train_test_split
+    targets = alpha * teacher.predict(x_train) + (1 - alpha) * y_train
+    if x_unlabeled is not None and len(x_unlabeled):
+        x_train = np.vstack([x_train, x_unlabeled])
+        targets = np.concatenate([targets, teacher.predict(x_unlabeled)])
+
+    x_fit, x_val, t_fit, t_val = train_test_split(x_train, targets, test_size=0.1, random_state=777)
+    candidates = candidate_models()
+    scores = {}
+    for name, candidate in candidates.items():
+        predictions = clone(candidate).fit(x_fit, t_fit).predict(x_val)
+        scores[name] = compute_metrics(predictions, t_val)
+        print(f'{name}: validation {scores[name]}')
+
+    best = max(scores, key=lambda name: scores[name]['spearman'])
+    print(f'Selected {best}')
+    return best, clone(candidates[best]).fit(x_train, targets), scores
+
+
+def main(teacher_name, student_name, report_file, alpha, unlabeled_file=None, feature_file=FEATURE_FILE):
+    from sklearn.model_selection import train_test_split
+    with stage('load_data') as record:
+        record.read(feature_file)
+        features, scores = load_data(feature_file)
+        record.rows(rows_in=len(features), rows_out=len(features))
+    x_train, x_test, y_train, y_test = train_test_split(features, scores, test_size=0.1, random_state=777)
+    x_unlabeled = None
+    if unlabeled_file:
+        x_unlabeled = pd.read_csv(unlabeled_file).fillna(0).drop(["word", "score"], axis=1, errors='ignore').to_numpy()
+
+    with stage('distill', alpha=alpha, unlabeled=0 if x_unlabeled is None else len(x_unlabeled)) as record:
+        teacher, teacher_load = timed_load(teacher_name)
+        best, student, validation = distill(teacher, x_train, y_train, alpha, x_unlabeled)
+
+        with open(student_name, 'wb') as f:
+            pickle.dump(student, f, protocol=pickle.HIGHEST_PROTOCOL)
+        student, student_load = timed_load(student_name)
+        record.rows(rows_in=len(x_train))
+        record.fields['student'] = best
+        record.wrote(student_name)
+
+    report = {
+        'student': best,
+        'alpha': alpha,
+        'feature_file': feature_file,
+        'validation': validation,
+        'teacher': {'load_s': teacher_load, **prediction_latency(teacher, x_test),
+                    'test': compute_metrics(teacher.predict(x_test), y_test)},
+        'distilled': {'load_s': student_load, **prediction_latency(student, x_test),
+                      'test': compute_metrics(student.predict(x_test), y_test)},
+    }
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name in ('teacher', 'distilled'):
+        r = report[name]
+        print(f"{name}: load {r['load_s']:.3f}s | {r['batch_ms_per_row']:.4f} ms/row (batch) | "
+              f"{r['single_row_ms']:.2f} ms (single row) | {r['test']}")
+    print(f'Saved {student_name} and {report_file}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--teacher', default=MODEL_NAME)
+    parser.add_argument('--output', default=STUDENT_NAME)
+    parser.add_argument('--report', default=REPORT_FILE)
+    parser.add_argument('--alpha', type=float, default=0.5, help='Weight of the teacher predictions in the targets')
+    parser.add_argument('--unlabeled', default=None, help='Feature file of extra words labeled by the teacher')
+    parser.add_argument('--feature_file', default=FEATURE_FILE, help='Training feature file (as for evaluate.py)')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    main(args.teacher, args.output, args.report, args.alpha, args.unlabeled, args.feature_file)
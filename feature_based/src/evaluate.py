@@ -1,21 +1,32 @@
 '''
-Usage:
+Usage (from feature_based/src, after pip install -e . at the repository root, see README.md):
 python evaluate.py
+python evaluate.py --cv 5 [--repeats 3] [--workers 4] [--results cv_results.json]
 
 Input: feature list used in training, Trained model
 Output: spearman's r, pearson r, MAE, MSE, RMSE score 
+
+With --cv, an unfitted copy of the model is refit on every fold of (repeated) k-fold
+cross-validation, folds running in parallel. The results file has the metrics of every fold,
+their mean and std, and bootstrap confidence intervals over the out-of-fold predictions.
 '''
 
+import json
 import pickle
-import pandas as pd
-import numpy as np
+import argparse
+# scipy, scikit-learn and joblib are imported in the functions that use them, as they take seconds to import
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
 
-from scipy import stats
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error, mean_squared_error
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
 
 FEATURE_FILE = '../data/train/original_features.csv'
 MODEL_NAME = 'AutoMLRegressor.pkl'
+CV_RESULTS_FILE = 'cv_results.json'
+METRICS = ['spearman', 'pearson', 'mae', 'mse', 'rmse']
+BOOTSTRAP_BATCH_VALUES = 10000000  # resampled predictions held in memory at a time
 
 def load_data(file):
     df = pd.read_csv(file)
@@ -29,7 +40,21 @@ def load_model(model_name):
     with open(model_name, 'rb') as f:
         return pickle.load(f)
 
+def compute_metrics(predictions, y_test):
+    from scipy import stats
+    from sklearn.metrics import mean_absolute_error, mean_squared_error
+    mse = mean_squared_error(predictions, y_test)
+    return {
+        'spearman': float(stats.spearmanr(predictions, y_test)[0]),
+        'pearson': float(stats.pearsonr(predictions, y_test)[0]),
+        'mae': float(mean_absolute_error(predictions, y_test)),
+        'mse': float(mse),
+        'rmse': float(np.sqrt(mse)),
+    }
+
 def evaluate(predictions, y_test):
+    from scipy import stats
+    from sklearn.metrics import mean_absolute_error, mean_squared_error
     # spearman's r
     print('Spearman:', stats.spearmanr(predictions, y_test))
 
@@ -45,12 +70,103 @@ def evaluate(predictions, y_test):
     # RMSE
     print('RMSE:', np.sqrt(mean_squared_error(predictions, y_test)))
 
-def main():
-    features, scores = load_data(FEATURE_FILE)
+def pearson_rows(a, b):
+    # pearson r of every row of a with the same row of b
+    a = a - a.mean(axis=1, keepdims=True)
+    b = b - b.mean(axis=1, keepdims=True)
+    return (a * b).sum(axis=1) / np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+
+def bootstrap_metrics(predictions, y_test, n_bootstrap=1000, seed=777):
+    from scipy import stats
+    # predictions is (n,) or (n_repeats, n): every repeat predicts the same n words. Words are resampled and
+    # a resampled word brings the predictions of all its repeats, so repeats are not counted as more words.
+    # Resamples are vectorized, (batch, n_repeats * n) at a time, metrics computed along axis 1
+    predictions = np.atleast_2d(predictions)
+    n_repeats, n = predictions.shape
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n, size=(n_bootstrap, n))
+    batch = max(1, BOOTSTRAP_BATCH_VALUES // (n_repeats * n))
+
+    boot = {m: [] for m in METRICS}
+    for start in range(0, n_bootstrap, batch):
+        i = idx[start:start + batch]
+        p = predictions[:, i].transpose(1, 0, 2).reshape(len(i), -1)
+        y = np.tile(y_test[i], (1, n_repeats))
+        mse = ((p - y) ** 2).mean(axis=1)
+        boot['spearman'].append(pearson_rows(stats.rankdata(p, axis=1), stats.rankdata(y, axis=1)))
+        boot['pearson'].append(pearson_rows(p, y))
+        boot['mae'].append(np.abs(p - y).mean(axis=1))
+        boot['mse'].append(mse)
+        boot['rmse'].append(np.sqrt(mse))
+    return {m: np.concatenate(values) for m, values in boot.items()}
+
+def fit_fold(model, x, y, train_idx, test_idx):
+    from sklearn.base import clone
+    predictions = clone(model).fit(x[train_idx], y[train_idx]).predict(x[test_idx])
+    return test_idx, predictions
+
+def cross_validate(model, features, scores, n_splits=5, n_repeats=1, workers=-1, n_bootstrap=1000, confidence=0.95):
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import RepeatedKFold
+    cv = RepeatedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=777)
+    results = Parallel(n_jobs=workers)(
+        delayed(fit_fold)(model, features, scores, train_idx, test_idx) for train_idx, test_idx in cv.split(features))
+
+    folds = []
+    out_of_fold = np.empty((n_repeats, len(scores)))
+    for i, (test_idx, predictions) in enumerate(results):
+        folds.append({'repeat': i // n_splits, 'fold': i % n_splits, 'n_test': len(test_idx),
+                      **compute_metrics(predictions, scores[test_idx])})
+        out_of_fold[i // n_splits, test_idx] = predictions
+
+    # bootstrap over words, each with its out-of-fold predictions of every repeat
+    boot = bootstrap_metrics(out_of_fold, scores, n_bootstrap)
+    alpha = (1 - confidence) / 2
+    summary = {}
+    for m in METRICS:
+        values = np.array([f[m] for f in folds])
+        low, high = np.quantile(boot[m], [alpha, 1 - alpha])
+        summary[m] = {'mean': float(values.mean()), 'std': float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+                      'ci_low': float(low), 'ci_high': float(high)}
+
+    return {'n_splits': n_splits, 'n_repeats': n_repeats, 'n_bootstrap': n_bootstrap,
+            'confidence': confidence, 'folds': folds, 'summary': summary}
+
+def main(model_name=MODEL_NAME, feature_file=FEATURE_FILE):
+    from sklearn.model_selection import train_test_split
+    features, scores = load_data(feature_file)
     x_train, x_test, y_train, y_test = train_test_split(features, scores, test_size=0.1, random_state=777)
-    regressor = load_model(MODEL_NAME)
+    regressor = load_model(model_name)
     predictions = regressor.predict(x_test)
     evaluate(predictions, y_test)
 
+def main_cv(model_name, feature_file, n_splits, n_repeats, workers, n_bootstrap, results_file):
+    features, scores = load_data(feature_file)
+    with stage('cross_validate', n_splits=n_splits, n_repeats=n_repeats, workers=workers) as record:
+        results = cross_validate(load_model(model_name), features, scores, n_splits, n_repeats, workers, n_bootstrap)
+        record.rows(rows_in=len(features) * n_repeats)
+    results.update({'model': model_name, 'feature_file': feature_file})
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for m, s in results['summary'].items():
+        print(f"{m}: {s['mean']:.4f} +- {s['std']:.4f} ({results['confidence']:.0%} CI {s['ci_low']:.4f} - {s['ci_high']:.4f})")
+    print(f'Saved {results_file}')
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--feature_file', default=FEATURE_FILE)
+    parser.add_argument('--cv', type=int, default=0, help='Number of folds (refits the model on every fold)')
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=-1, help='Folds fit in parallel (-1: all cores)')
+    parser.add_argument('--n_bootstrap', type=int, default=1000)
+    parser.add_argument('--results', default=CV_RESULTS_FILE)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    if args.cv:
+        main_cv(args.model, args.feature_file, args.cv, args.repeats, args.workers, args.n_bootstrap, args.results)
+    else:
+        main(args.model, args.feature_file)
@@ -4,21 +4,78 @@ Need to specify the features for experiment.
 
 @jychoi
 '''
-import syllables
-from nltk.corpus import wordnet
-import os, sys
+import os
 import json
-import pandas as pd
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+from wordnet_index import WordNetIndex, compute_wordnet_features, WORDNET_INDEX_DIR, WORDNET_FEATURES
+from feature_store import FeatureStore, group_key, FEATURE_STORE_DIR
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
+
+syllables = lazy_import('syllables')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 FEATURE_DIR = '../data/features'
 FEATURES_TO_USE = {}
+SURFACE_FEATURES = ['word_length', 'syllable_length']  # columns of surface_features
+# Bump a group's version when its method changes, so stored features are recomputed
+FEATURE_GROUP_VERSIONS = {'surface_features': 1, 'wordnet_features': 1, 'extract_from_file': 1}
+MIN_WORDS_PER_WORKER = 1000  # below this, starting worker processes costs more than estimating syllables
+
+_syllable_memo = {}
+
+
+def estimate_syllables(words, workers=1):
+    '''
+    syllables.estimate for a list of words, memoized across wordlists.
+    With workers > 1, words not estimated yet are spread over a process pool in chunks.
+    '''
+    missing = [w for w in dict.fromkeys(words) if w not in _syllable_memo]
+    workers = min(workers, len(missing) // MIN_WORDS_PER_WORKER)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            computed = list(executor.map(syllables.estimate, missing, chunksize=max(1, len(missing) // (workers * 4))))
+    else:
+        computed = [syllables.estimate(w) for w in missing]
+    _syllable_memo.update(zip(missing, computed))
+    return [_syllable_memo[w] for w in words]
+
+
+@functools.lru_cache(maxsize=None)
+def load_feature_file(path, mtime_ns):
+    '''
+    Load a feature file indexed by lowercased word, keeping the first row of duplicate words.
+    Cached per (path, mtime), so a file is read once per process unless it changes.
+    '''
+    extension = os.path.splitext(path)[-1]
+    if extension == '.csv':
+        delimiter = ','
+    elif extension == '.tsv':
+        delimiter = '\t'
+
+    df = pd.read_csv(path, delimiter=delimiter)
+    df['word'] = df['word'].str.lower()
+    df = df[df['word'].notna()]
+    return df.drop_duplicates('word', keep='first').set_index('word')
 
 class FeatureExtractor:
-    def __init__(self, wordlist, feature_dir, features_to_use):
+    def __init__(self, wordlist, feature_dir, features_to_use, wordnet_index_dir=None, workers=1, feature_store_dir=None,
+                 feature_store_read_only=False, verbose=True):
         
-        self.wordlist = [w.lower() for w in wordlist]
+        self.set_wordlist(wordlist)
         self.features_to_use = features_to_use
         self.feature_dir = feature_dir
+        self.workers = workers
+        self.verbose = verbose  # False: no progress lines, e.g. for every batch of the prediction server
+        self.wordnet_index = None
+        if wordnet_index_dir and os.path.exists(wordnet_index_dir):
+            self.wordnet_index = WordNetIndex(wordnet_index_dir)
+        self.feature_store = FeatureStore(feature_store_dir, feature_store_read_only, verbose) if feature_store_dir else None
         self.feature_methods = {
             'surface_features': self.surface_features,
             'wordnet_features': self.wordnet_features,
@@ -26,80 +83,129 @@ class FeatureExtractor:
         }
 
 
-    def surface_features(self, _):
-        word_length = [len(w) for w in self.wordlist]
-        syllable_length = [syllables.estimate(w) for w in self.wordlist]
+    def set_wordlist(self, wordlist):
+        # reuse the loaded resources (WordNet index, feature store, cached files) for another wordlist
+        self.wordlist = [w.lower() for w in wordlist]
+
+
+    def surface_features(self, _, words=None):
+        words = self.wordlist if words is None else words
+        word_length = [len(w) for w in words]
+        syllable_length = estimate_syllables(words, self.workers)
         return {'word_length': word_length, 'syllable_length': syllable_length}
     
 
-    def wordnet_features(self, _):
-        num_synsets = []
-        num_hypernyms = []
-        num_hyponyms = []
+    def wordnet_features(self, _, words=None):
+        words = self.wordlist if words is None else words
+        if self.wordnet_index is not None:
+            features, found = self.wordnet_index.lookup(words)
+        else:
+            features = np.zeros((len(words), len(WORDNET_FEATURES)), dtype=np.int32)
+            found = np.zeros(len(words), dtype=bool)
 
-        for word in self.wordlist:
-            synsets = wordnet.synsets(word)
-            num_synsets += [len(synsets)]
+        # words not in the precomputed index are looked up in WordNet (memoized)
+        missing = [w for w, f in zip(words, found) if not f]
+        if missing:
+            features[~found] = compute_wordnet_features(missing, self.workers)
 
-            hyper_num = 0
-            hypon_num = 0
-            for syn in synsets:
-                if syn.lemmas()[0].name() == word: # synset of current word
-                    hyper_num += len(syn.hypernyms())
-                    hypon_num += len(syn.hyponyms())
-            num_hypernyms += [hyper_num]
-            num_hyponyms += [hypon_num]
-        return {"num_synsets": num_synsets, "num_hypernyms": num_hypernyms, "num_hyponyms": num_hyponyms}
+        return {name: features[:, i].tolist() for i, name in enumerate(WORDNET_FEATURES)}
 
 
-    def extract_from_file(self, fname2features):
+    def extract_from_file(self, fname2features, words=None):
+        words = self.wordlist if words is None else words
         all_features = {}
         for fname, feature_list in fname2features.items():
+            if self.verbose:
+                for ft in feature_list:
+                    print("Extracting", ft, "from", fname)
+
+            path = os.path.join(self.feature_dir, fname)
+            df = load_feature_file(path, os.stat(path).st_mtime_ns)
+
+            # one index lookup per file instead of a scan per word
+            positions = df.index.get_indexer(words)
+            found = positions >= 0
             for ft in feature_list:
-                print("Extracting", ft, "from", fname)
-            extension = os.path.splitext(fname)[-1]
-            if extension == '.csv':
-                delimiter = ','
-            elif extension == '.tsv':
-                delimiter = '\t'
-
-
-            df = pd.read_csv(os.path.join(self.feature_dir, fname), delimiter=delimiter)
-            df['word'] = df['word'].str.lower()
-            df = df[df['word'].notna()].reset_index() 
-
-            features = {ft: [] for ft in feature_list}
-            try:
-                filtered_df = df[df['word'].isin(self.wordlist)]
-                for word in self.wordlist:
-                    row = filtered_df[filtered_df['word'] == word]
-                    if len(row) == 0:
-                        ## give 0 as default value
-                        for ft in feature_list:
-                            features[ft] += [0]
-                    else:
-                        for ft in feature_list:
-                            features[ft] += [row[ft].values[0]]
-                all_features.update(features)
-            except KeyboardInterrupt:
-                sys.exit()
-            
+                values = df[ft].to_numpy()
+                ## give 0 as default value
+                features = np.zeros(len(words), dtype=values.dtype if values.dtype.kind in 'iuf' else object)
+                features[found] = values[positions[found]]
+                all_features[ft] = features
+
         return all_features
 
-    
-    def make_dataframe(self):
-        feat_df = pd.DataFrame()
-        feat_df["word"] = self.wordlist
 
+    def feature_columns(self):
+        '''
+        Names of the feature columns make_dataframe returns (besides word), without computing them.
+        '''
+        columns = []
         for group, features in self.features_to_use.items():
-            for cname, cfeat in self.feature_methods[group](features).items():
-                feat_df[cname] = cfeat
-        
-        return feat_df
+            if group == 'surface_features':
+                columns += SURFACE_FEATURES
+            elif group == 'wordnet_features':
+                columns += WORDNET_FEATURES
+            elif group == 'extract_from_file':
+                columns += [ft for feature_list in features.values() for ft in feature_list]
+        return columns
+
+    
+    def make_dataframe(self):
+        '''
+        Every feature group is computed once per unique word, one group after the other; with workers > 1
+        the CPU-bound groups (syllables, WordNet) spread their words over a process pool.
+        The frame is then built in one go, in the order of the wordlist.
+        '''
+        codes, unique_words = pd.factorize(pd.Series(self.wordlist, dtype=object))
+        unique_words = unique_words.tolist()
+
+        results = [self.group_features(group, features, unique_words) for group, features in self.features_to_use.items()]
+
+        columns = {'word': self.wordlist}
+        for group_features in results:
+            for cname, cfeat in group_features.items():
+                columns[cname] = np.asarray(cfeat)[codes]
+        return pd.DataFrame(columns)
+
+
+    def group_features(self, group, features, words):
+        with stage('features', unit=group, stored=self.feature_store is not None) as record:
+            if self.feature_store is not None:
+                group_features = self.stored_features(group, features, words)
+            else:
+                group_features = self.feature_methods[group](features, words)
+            record.rows(rows_in=len(words), rows_out=len(words))
+            record.fields.update({'columns': len(group_features), 'wordlist': len(self.wordlist)})
+        return group_features
+
+
+    def stored_features(self, group, features, words=None):
+        '''
+        Features of a group read from the feature store; only words missing from the store are computed.
+        Every feature file of extract_from_file is stored separately.
+        '''
+        words = self.wordlist if words is None else words
+        method = self.feature_methods[group]
+        version = FEATURE_GROUP_VERSIONS[group]
+        if group == 'extract_from_file':
+            units = [({fname: feature_list}, [os.path.join(self.feature_dir, fname)])
+                     for fname, feature_list in features.items()]
+        else:
+            units = [(features, [])]
+
+        group_features = {}
+        for args, files in units:
+            key = group_key(group, version, args, files)
+            group_features.update(self.feature_store.get(key, words, lambda missing: method(args, missing)))
+        return group_features
          
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    configure_from_args(parser.parse_args())
+
     file_to_extract = '../data/wordlist/original_score.json'
 
     if 'original' in file_to_extract:
@@ -117,7 +223,8 @@ if __name__ == "__main__":
         wordlist = [w.lower() for w in df['word']]
         wordlist = [w for w in wordlist if w not in org_wordlist] # needs prediction
 
-    feature_extractor = FeatureExtractor(wordlist, FEATURE_DIR, FEATURES_TO_USE)
+    feature_extractor = FeatureExtractor(wordlist, FEATURE_DIR, FEATURES_TO_USE, WORDNET_INDEX_DIR,
+                                         feature_store_dir=FEATURE_STORE_DIR)
     feature_df = feature_extractor.make_dataframe()
 
     if 'original' in file_to_extract:
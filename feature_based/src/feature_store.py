@@ -0,0 +1,109 @@
+'''
+Persistent feature store keyed by word and feature group.
+
+Each feature group (a FeatureExtractor method with its arguments, or one feature file)
+is stored as its own directory of Parquet parts indexed by the normalized (lowercased) word.
+The directory name contains a version hash of the group, its arguments and, for feature
+files, the file contents, so changing any of them starts a new table.
+Only words missing from a table are computed, and they are written as a new part, so adding
+words never rewrites what is stored. Parts are merged once there are more than MAX_PARTS.
+Loaded tables are kept in memory and only parts written since (e.g. by another process) are read.
+A read-only store computes missing words without writing them (e.g. in the prediction server),
+and a quiet one (verbose=False) does not print the words it computes.
+'''
+import os
+import json
+import uuid
+import hashlib
+
+from lcp.hashing import cached_sha256_file
+from lcp.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+FEATURE_STORE_DIR = '../data/feature_store'
+MAX_PARTS = 64
+
+
+def group_key(group, version, args, files=()):
+    signature = json.dumps({'version': version, 'args': args, 'files': [cached_sha256_file(f) for f in files]},
+                           sort_keys=True, default=str)
+    return f'{group}-{hashlib.sha256(signature.encode()).hexdigest()[:16]}'
+
+
+class FeatureStore:
+    def __init__(self, store_dir=FEATURE_STORE_DIR, read_only=False, verbose=True):
+        self.store_dir = store_dir
+        self.read_only = read_only
+        self.verbose = verbose
+        self.tables = {}  # key -> (names of the loaded parts, table)
+        if not read_only:
+            os.makedirs(store_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.store_dir, key)
+
+    def parts(self, key):
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name for name in os.listdir(path) if name.endswith('.parquet'))
+
+    def load(self, key):
+        loaded, table = self.tables.get(key, ([], None))
+        loaded_parts = set(loaded)
+        new_parts = [name for name in self.parts(key) if name not in loaded_parts]
+        if new_parts:
+            try:
+                tables = ([table] if table is not None else []) + \
+                         [pd.read_parquet(os.path.join(self.path(key), name)) for name in new_parts]
+            except FileNotFoundError:
+                # another process compacted the table meanwhile; read it again
+                self.tables.pop(key, None)
+                return self.load(key)
+            table = pd.concat(tables)
+            # a word can be in two parts when two processes computed it at the same time
+            table = table[~table.index.duplicated(keep='first')]
+            self.tables[key] = (loaded + new_parts, table)
+        return table
+
+    def save(self, key, table):
+        os.makedirs(self.path(key), exist_ok=True)
+        name = f'part-{pd.Timestamp.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}.parquet'
+        tmp_path = os.path.join(self.path(key), f'.{name}.tmp')
+        table.to_parquet(tmp_path)
+        os.replace(tmp_path, os.path.join(self.path(key), name))
+        return name
+
+    def compact(self, key):
+        '''
+        Merge the parts of a table into one, then drop the merged parts.
+        '''
+        parts = self.parts(key)
+        table = self.load(key)
+        self.save(key, table)
+        for name in parts:
+            os.remove(os.path.join(self.path(key), name))
+        self.tables.pop(key, None)
+
+    def get(self, key, words, compute):
+        '''
+        Feature columns for words (in order, duplicates allowed).
+        compute(missing_words) returns {column: values} for the unique words not stored yet.
+        '''
+        table = self.load(key)
+        unique_words = pd.unique(pd.Series(words, dtype=object))
+        missing = unique_words if table is None else unique_words[table.index.get_indexer(unique_words) < 0]
+
+        if len(missing) > 0:
+            if self.verbose:
+                print(f'Computing {key} for {len(missing)} of {len(unique_words)} words')
+            computed = pd.DataFrame(compute(list(missing)), index=pd.Index(missing, name='word'))
+            table = computed if table is None else pd.concat([table, computed])
+            if not self.read_only:
+                name = self.save(key, computed)
+                self.tables[key] = (self.tables.get(key, ([], None))[0] + [name], table)
+                if len(self.parts(key)) > MAX_PARTS:
+                    self.compact(key)
+
+        return {c: table[c].reindex(words).to_numpy() for c in table.columns}
@@ -0,0 +1,282 @@
+'''
+Usage (from feature_based/src, after pip install -e . at the repository root, see README.md):
+python predict.py --input words.txt --output scores.tsv --features features.json
+python predict.py --serve --port 8000 --features '{"surface_features": [], "wordnet_features": []}'
+
+Input: words (one per line, or a csv/tsv with a 'word' column), Trained model
+Output: complexity score per word
+
+--features gives the feature groups to extract, as FEATURES_TO_USE in feature_extractor.py (JSON, or a
+.json file). The model's feature columns and their order are read from the run file train.py saved next
+to the model ({output}_run.json), or from the header of --feature_file. The groups must produce every
+one of these columns.
+
+In server mode, POST /predict with {"words": [...]} returns {"scores": [...], "latency_ms": ...}.
+Concurrent requests are grouped into micro-batches before prediction. GET /stats reports
+latency and throughput.
+
+--feature_store reads stored features (feature_store.py) instead of computing them. Batch mode also
+stores the features of new words; the server only reads the store, so requests never write to it.
+'''
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from evaluate import load_model, FEATURE_FILE, MODEL_NAME
+from feature_extractor import FeatureExtractor, FEATURE_DIR, FEATURES_TO_USE
+from wordnet_index import WORDNET_INDEX_DIR
+from feature_store import FEATURE_STORE_DIR
+
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+def run_file(model_name):
+    return f'{os.path.splitext(model_name)[0]}_run.json'
+
+
+def model_columns(model_name, feature_file=None):
+    '''
+    Feature columns of a model, in training order: from the header of feature_file if it is given,
+    else from the run file of the model, else from the header of the default training feature file.
+    '''
+    if feature_file is None and os.path.exists(run_file(model_name)):
+        with open(run_file(model_name), 'r') as f:
+            return json.load(f)['columns']
+    feature_file = FEATURE_FILE if feature_file is None else feature_file
+    return [c for c in pd.read_csv(feature_file, nrows=0).columns if c not in ('word', 'score')]
+
+
+def load_features_to_use(value):
+    '''
+    Feature groups from a JSON string or a .json file.
+    '''
+    if os.path.isfile(value):
+        with open(value, 'r') as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+class Predictor:
+    '''
+    Loads the model and feature resources once and scores batches of raw words.
+    Feature columns are ordered as the model was trained (model_columns); features_to_use must produce all of them.
+    Features are computed unless feature_store_dir is given (read_only: missing words are not stored).
+    '''
+    def __init__(self, model_name=MODEL_NAME, feature_file=None, features_to_use=FEATURES_TO_USE,
+                 feature_dir=FEATURE_DIR, wordnet_index_dir=WORDNET_INDEX_DIR, feature_store_dir=None, read_only=False):
+        self.model = load_model(model_name)
+        self.feature_columns = model_columns(model_name, feature_file)
+        # quiet: the extractor runs for every batch of the server
+        self.extractor = FeatureExtractor([], feature_dir, features_to_use, wordnet_index_dir,
+                                          feature_store_dir=feature_store_dir, feature_store_read_only=read_only,
+                                          verbose=False)
+        extracted = set(self.extractor.feature_columns())
+        missing = [c for c in self.feature_columns if c not in extracted]
+        if missing:
+            raise ValueError(f'{model_name} needs feature columns that the feature groups {sorted(features_to_use)} '
+                             f'do not produce: {missing}. Pass the groups used for training with --features.')
+
+    def predict(self, words):
+        if len(words) == 0:
+            return np.array([])
+        self.extractor.set_wordlist(words)
+        feat_df = self.extractor.make_dataframe().fillna(0)
+        return self.model.predict(feat_df[self.feature_columns].to_numpy())
+
+
+def read_words(path):
+    extension = os.path.splitext(path)[-1]
+    if extension in ('.csv', '.tsv'):
+        df = pd.read_csv(path, delimiter='\t' if extension == '.tsv' else ',')
+        return df['word'].astype(str).tolist()
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def predict_file(predictor, input_path, output_path, batch_size=10000):
+    with stage('predict', batch_size=batch_size) as record:
+        record.read(input_path)
+        words = read_words(input_path)
+
+        start = time.perf_counter()
+        scores = []
+        for i in range(0, len(words), batch_size):
+            scores.append(predictor.predict(words[i:i + batch_size]))
+            record.rows(rows_in=len(words[i:i + batch_size]), rows_out=len(scores[-1]))
+            record.progress(min(i + batch_size, len(words)), len(words), 'words')
+        scores = np.concatenate(scores or [[]])
+        elapsed = time.perf_counter() - start
+
+        pd.DataFrame({'word': words, 'score': scores}).to_csv(output_path, sep='\t', index=False)
+        record.wrote(output_path)
+    print(f'Scored {len(words)} words in {elapsed:.2f}s ({len(words) / max(elapsed, 1e-9):.0f} words/sec)')
+    print(f'Saved {output_path}')
+
+
+class MicroBatcher:
+    '''
+    Collects concurrent requests for up to max_wait_ms (or max_batch_words words) and scores them
+    with a single predict call on a background thread.
+    '''
+    def __init__(self, predictor, max_batch_words=1024, max_wait_ms=5):
+        self.predictor = predictor
+        self.max_batch_words = max_batch_words
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.latencies = []
+        self.n_words = 0
+        self.n_batches = 0
+        self.started = time.perf_counter()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, words):
+        start = time.perf_counter()
+        request = {'words': words, 'done': threading.Event(), 'scores': None, 'error': None}
+        self.requests.put(request)
+        request['done'].wait()
+        latency = time.perf_counter() - start
+        with self.stats_lock:
+            self.latencies.append(latency)
+            self.n_words += len(words)
+        if request['error'] is not None:
+            raise request['error']
+        return request['scores'], latency
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            n_words = len(batch[0]['words'])
+            deadline = time.perf_counter() + self.max_wait
+            while n_words < self.max_batch_words:
+                try:
+                    request = self.requests.get(timeout=max(0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                n_words += len(request['words'])
+
+            try:
+                scores = self.predictor.predict([w for request in batch for w in request['words']])
+                offset = 0
+                for request in batch:
+                    request['scores'] = scores[offset:offset + len(request['words'])].tolist()
+                    offset += len(request['words'])
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            self.n_batches += 1
+            for request in batch:
+                request['done'].set()
+
+    def stats(self):
+        with self.stats_lock:
+            latencies = np.array(self.latencies) * 1000
+            elapsed = time.perf_counter() - self.started
+            return {
+                'requests': len(latencies),
+                'batches': self.n_batches,
+                'words': self.n_words,
+                'words_per_sec': self.n_words / max(elapsed, 1e-9),
+                'latency_ms_mean': float(latencies.mean()) if len(latencies) else None,
+                'latency_ms_p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'latency_ms_p95': float(np.percentile(latencies, 95)) if len(latencies) else None,
+            }
+
+
+def make_handler(batcher):
+    class PredictHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self.send_json(200, batcher.stats())
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self.send_json(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                words = [str(w) for w in body['words']]
+            except (ValueError, KeyError, TypeError):
+                self.send_json(400, {'error': 'expected {"words": [...]}'})
+                return
+            try:
+                scores, latency = batcher.submit(words)
+            except Exception as e:
+                self.send_json(500, {'error': str(e)})
+                return
+            self.log_message('predicted %d words in %.1f ms', len(words), latency * 1000)
+            self.send_json(200, {'scores': scores, 'latency_ms': latency * 1000})
+
+        def log_message(self, format, *args):
+            print(f'{self.address_string()} {format % args}')
+
+    return PredictHandler
+
+
+def serve(predictor, host='127.0.0.1', port=8000, max_batch_words=1024, max_wait_ms=5):
+    batcher = MicroBatcher(predictor, max_batch_words, max_wait_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    print(f'Serving on http://{host}:{port} (POST /predict, GET /stats)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(batcher.stats()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--features', type=load_features_to_use, default=FEATURES_TO_USE,
+                        help='Feature groups to extract (JSON or a .json file), as FEATURES_TO_USE in feature_extractor.py')
+    parser.add_argument('--feature_file', default=None,
+                        help='Training feature file whose header gives the model columns '
+                             f'(default: the run file of the model, else {FEATURE_FILE})')
+    parser.add_argument('--feature_dir', default=FEATURE_DIR, help='Where the feature files of extract_from_file are')
+    parser.add_argument('--wordnet_index_dir', default=WORDNET_INDEX_DIR)
+    parser.add_argument('--input', help='Words to score (txt, csv or tsv with a word column)')
+    parser.add_argument('--output', default='predictions.tsv')
+    parser.add_argument('--batch_size', type=int, default=10000)
+    parser.add_argument('--serve', action='store_true', help='Run a local HTTP server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch_words', type=int, default=1024)
+    parser.add_argument('--max_wait_ms', type=float, default=5)
+    parser.add_argument('--feature_store', nargs='?', const=FEATURE_STORE_DIR, default=None,
+                        help=f'Read features from the feature store (default dir {FEATURE_STORE_DIR}); read-only with --serve')
+    add_arguments(parser)
+    args = parser.parse_args()
+    if not args.serve and args.input is None:
+        parser.error('--input is required unless --serve is given')
+    configure_from_args(args)
+
+    try:
+        predictor = Predictor(args.model, args.feature_file, args.features, args.feature_dir, args.wordnet_index_dir,
+                              feature_store_dir=args.feature_store, read_only=args.serve)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.serve:
+        serve(predictor, args.host, args.port, args.max_batch_words, args.max_wait_ms)
+    else:
+        predict_file(predictor, args.input, args.output, args.batch_size)
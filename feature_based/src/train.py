@@ -1,42 +1,138 @@
+'''
+Usage (from feature_based/src, after pip install -e . at the repository root, see README.md):
+python train.py [--feature_file original_features.csv] [--time_budget 120] [--per_run_limit 30]
+                [--n_jobs 4] [--memory_mb 8192] [--warm_start AutoMLRegressor_run.json | --refit AutoMLRegressor_run.json]
+
+Input: feature file (csv with word, score and feature columns)
+Output: {output}.pkl (the AutoSklearn ensemble), {output}_run.json (budgets, feature columns, the
+        configurations of the ensemble and test metrics) and {output}_performance.csv (time-to-accuracy:
+        best single model and ensemble scores over the seconds of the search)
+
+The parsed feature matrix is cached as .npz in --cache_dir, keyed by the hash of the feature file.
+--memory_mb is the memory budget of the whole search and is split over the --n_jobs workers.
+--warm_start evaluates the ensemble configurations of a previous run first (e.g. after feature columns
+changed); --refit refits the previous ensemble on the new rows without searching (same feature columns).
+'''
 import os
+import json
 import pickle
+import argparse
 
-import pandas as pd
-import wandb
-import matplotlib.pyplot as plt
+# auto-sklearn and scikit-learn are imported when training starts, and wandb and matplotlib are
+# optional: without them the run is not logged or the plots are skipped
 
-from sklearn.model_selection import train_test_split
-from autosklearn.regression import AutoSklearnRegressor
+from lcp.instrument import stage, add_arguments, configure_from_args
+from lcp.hashing import sha256_file
+from lcp.lazy import lazy_import
 
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 FEATURE_DIR = '../data/train'
 FEATURE_FILE = os.path.join(FEATURE_DIR, 'original_features.csv')
+FEATURE_CACHE_DIR = os.path.join(FEATURE_DIR, 'cache')
 MODEL_NAME = 'AutoMLRegressor'
 WANDB_PROJECT = 'lcp_feature_autoML'
 FEATURES_PLOT_FILE = 'regressor_features.png'
+BUDGET = {'time_budget': 120, 'per_run_limit': 30, 'n_jobs': 1, 'memory_mb': 3072, 'seed': 1}
 
 
 def init_wandb(project, model):
+    try:
+        import wandb
+    except ImportError:
+        print('wandb is not installed, the run is not logged.')
+        return None
     wandb.init(project=project)
     wandb.config.update({"model": model})
+    return wandb
+
+
+def load_data(file, cache_dir=None):
+    '''
+    Feature matrix, scores and feature column names of a feature file.
+    With cache_dir, the parsed matrix is saved as .npz and reused while the file content is unchanged.
+    '''
+    cache_path = None
+    if cache_dir:
+        name = os.path.splitext(os.path.basename(file))[0]
+        cache_path = os.path.join(cache_dir, f'{name}-{sha256_file(file)[:16]}.npz')
+        if os.path.exists(cache_path):
+            with np.load(cache_path, allow_pickle=False) as data:
+                return data['features'], data['scores'], data['columns'].tolist()
 
-
-def load_data(file):
     df = pd.read_csv(file)
     df = df.fillna(0)
-    features = df.drop(["word", "score"], axis=1).to_numpy()
+    columns = list(df.drop(["word", "score"], axis=1).columns)
+    features = df[columns].to_numpy()
     scores = df["score"].to_numpy()
 
-    return features, scores, df
-
-
-def train_model(features, scores):
-    x_train, x_test, y_train, y_test = train_test_split(features, scores, test_size=0.1, random_state=777)
-
-    regressor = AutoSklearnRegressor(time_left_for_this_task=120, per_run_time_limit=30)
-    regressor.fit(x_train, y_train)
-
-    return regressor, x_train, x_test, y_train, y_test
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{cache_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, features=features, scores=scores, columns=np.array(columns))
+        os.replace(tmp_path, cache_path)
+        print(f'Cached the feature matrix of {file} in {cache_path}')
+    return features, scores, columns
+
+
+def split_data(features, scores):
+    from sklearn.model_selection import train_test_split
+    return train_test_split(features, scores, test_size=0.1, random_state=777)
+
+
+class WarmStart:
+    '''
+    get_smac_object_callback for AutoSklearnRegressor that puts the configurations of a previous
+    ensemble before the meta-learning configurations, so the search evaluates them first.
+    Configurations that do not fit the new configuration space are skipped.
+    '''
+    def __init__(self, configurations):
+        self.configurations = configurations
+
+    def __call__(self, **smac_args):
+        from ConfigSpace import Configuration
+        from autosklearn.smbo import get_smac_object
+        space = smac_args['scenario_dict']['cs']
+        previous = []
+        for values in self.configurations:
+            try:
+                previous.append(Configuration(space, values=values))
+            except (ValueError, KeyError) as e:
+                print(f'Skipping a previous configuration: {e}')
+        smac_args['metalearning_configurations'] = previous + list(smac_args['metalearning_configurations'])
+        return get_smac_object(**smac_args)
+
+
+def train_model(x_train, y_train, x_test, y_test, budget=BUDGET, warm_start=None):
+    from autosklearn.regression import AutoSklearnRegressor
+
+    regressor = AutoSklearnRegressor(
+        time_left_for_this_task=budget['time_budget'],
+        per_run_time_limit=budget['per_run_limit'],
+        n_jobs=budget['n_jobs'],
+        memory_limit=max(budget['memory_mb'] // budget['n_jobs'], 1),  # auto-sklearn limits every job
+        seed=budget['seed'],
+        get_smac_object_callback=WarmStart(warm_start) if warm_start else None,
+    )
+    # the test split only shows up in the ensemble_test_score of the time-to-accuracy curve
+    regressor.fit(x_train, y_train, X_test=x_test, y_test=y_test)
+
+    # the callback is only needed for the search; the pickled model should not depend on this script
+    regressor.get_smac_object_callback = None
+    return regressor
+
+
+def ensemble_configurations(regressor):
+    return [model.config.get_dictionary() for _, model in regressor.get_models_with_weights()
+            if getattr(model, 'config', None) is not None]
+
+
+def performance_over_time(regressor):
+    curve = regressor.performance_over_time_.sort_values('Timestamp').reset_index(drop=True)
+    curve.insert(0, 'seconds', (curve['Timestamp'] - curve['Timestamp'].min()).dt.total_seconds())
+    return curve
 
 
 def save_model(model, filename):
@@ -44,14 +140,35 @@ def save_model(model, filename):
         pickle.dump(model, f)
 
 
-def plot_features(regressor, df):
+def plot_features(regressor, feature_names):
     if hasattr(regressor, 'feature_importances_'):
-        feature_names = list(df.drop(["word", "score"], axis=1))
+        try:
+            import matplotlib.pyplot as plt
+        except ImportError:
+            print('matplotlib is not installed, skipping the feature plot.')
+            return
         plt.barh(feature_names, regressor.feature_importances_)
         plt.savefig(FEATURES_PLOT_FILE, bbox_inches='tight', pad_inches=0.3)
 
 
-def log_wandb(regressor, x_train, x_test, y_train, y_test):
+def plot_performance(curve, filename):
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib is not installed, skipping the time-to-accuracy plot.')
+        return
+    plt.figure()
+    for column in ('single_best_optimization_score', 'ensemble_optimization_score', 'ensemble_test_score'):
+        if column in curve:
+            plt.step(curve['seconds'], curve[column], where='post', label=column)
+    plt.xlabel('seconds')
+    plt.ylabel('score (R2)')
+    plt.legend()
+    plt.savefig(filename, bbox_inches='tight', pad_inches=0.3)
+    plt.close()
+
+
+def log_wandb(wandb, regressor, x_train, x_test, y_train, y_test, curve=None):
     wandb.sklearn.plot_regressor(regressor, x_train, x_test, y_train, y_test, model_name=MODEL_NAME)
 
     models = regressor.show_models()
@@ -70,20 +187,96 @@ def log_wandb(regressor, x_train, x_test, y_train, y_test):
 
     wandb.log({"model_details": model_info})
 
-
-def main():
-    init_wandb(WANDB_PROJECT, MODEL_NAME)
-
-    features, scores, df = load_data(FEATURE_FILE)
-
-    regressor, x_train, x_test, y_train, y_test = train_model(features, scores)
-
-    save_model(regressor, f"{MODEL_NAME}.pkl")
-
-    plot_features(regressor, df)
-
-    log_wandb(regressor, x_train, x_test, y_train, y_test)
+    if curve is not None:
+        wandb.log({"performance_over_time": wandb.Table(dataframe=curve.astype({'Timestamp': str}))})
+
+
+def load_run(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def main(feature_file=FEATURE_FILE, output=MODEL_NAME, cache_dir=FEATURE_CACHE_DIR, budget=BUDGET,
+         warm_start=None, refit=None, use_wandb=True, wandb_project=WANDB_PROJECT):
+    from evaluate import compute_metrics
+
+    wandb = init_wandb(wandb_project, MODEL_NAME) if use_wandb else None
+
+    with stage('load_data', cache=bool(cache_dir)) as record:
+        record.read(feature_file)
+        features, scores, columns = load_data(feature_file, cache_dir)
+        record.rows(rows_in=len(features), rows_out=len(features))
+    x_train, x_test, y_train, y_test = split_data(features, scores)
+
+    previous = load_run(refit or warm_start) if (refit or warm_start) else None
+    curve = None
+    with stage('train', model=MODEL_NAME, refit=bool(refit), warm_start=bool(warm_start), **budget) as record:
+        if refit:
+            # only rows changed: the previous ensemble is refit without a new search
+            if previous['columns'] != columns:
+                raise ValueError(f"{refit} was trained on other feature columns; use --warm_start instead.")
+            with open(previous['model'], 'rb') as f:
+                regressor = pickle.load(f)
+            regressor.refit(x_train, y_train)
+        else:
+            regressor = train_model(x_train, y_train, x_test, y_test, budget,
+                                    previous['configurations'] if previous else None)
+            curve = performance_over_time(regressor)
+        record.rows(rows_in=len(x_train))
+        metrics = compute_metrics(regressor.predict(x_test), y_test)
+        record.fields.update(metrics)
+
+    model_file = f"{output}.pkl"
+    save_model(regressor, model_file)
+    run = {
+        'model': os.path.abspath(model_file),
+        'feature_file': os.path.abspath(feature_file),
+        'feature_sha256': sha256_file(feature_file),
+        'columns': columns,
+        'rows': len(features),
+        'budget': budget,
+        'warm_start': warm_start,
+        'refit': refit,
+        'configurations': ensemble_configurations(regressor),
+        'metrics': metrics,
+    }
+    if curve is not None:
+        run['performance_file'] = os.path.abspath(f'{output}_performance.csv')
+        curve.to_csv(run['performance_file'], index=False)
+        plot_performance(curve, f'{output}_performance.png')
+    with open(f'{output}_run.json', 'w') as f:
+        json.dump(run, f, indent=1, default=str)
+    print(f"Saved {model_file} and {output}_run.json ({len(run['configurations'])} ensemble configurations, "
+          f"test spearman {metrics['spearman']:.4f}, rmse {metrics['rmse']:.4f})")
+
+    plot_features(regressor, columns)
+
+    if wandb is not None:
+        log_wandb(wandb, regressor, x_train, x_test, y_train, y_test, curve)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--feature_file', default=FEATURE_FILE)
+    parser.add_argument('--output', default=MODEL_NAME, help='Model name; writes {output}.pkl, {output}_run.json')
+    parser.add_argument('--cache_dir', default=FEATURE_CACHE_DIR, help='Where parsed feature matrices are cached')
+    parser.add_argument('--no_cache', action='store_true', help='Always parse the feature file')
+    parser.add_argument('--time_budget', type=int, default=BUDGET['time_budget'], help='Seconds for the whole search')
+    parser.add_argument('--per_run_limit', type=int, default=BUDGET['per_run_limit'], help='Seconds per model fit')
+    parser.add_argument('--n_jobs', type=int, default=BUDGET['n_jobs'], help='CPU cores used by the search')
+    parser.add_argument('--memory_mb', type=int, default=BUDGET['memory_mb'],
+                        help='Memory budget of the search (MB), split over the jobs')
+    parser.add_argument('--seed', type=int, default=BUDGET['seed'])
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument('--warm_start', default=None, help='Run file of a previous run whose configurations are tried first')
+    start.add_argument('--refit', default=None, help='Run file of a previous run to refit on the new rows')
+    parser.add_argument('--no_wandb', action='store_true', help='Do not log the run to wandb')
+    parser.add_argument('--wandb_project', default=WANDB_PROJECT)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    budget = {'time_budget': args.time_budget, 'per_run_limit': args.per_run_limit, 'n_jobs': args.n_jobs,
+              'memory_mb': args.memory_mb, 'seed': args.seed}
+    main(args.feature_file, args.output, None if args.no_cache else args.cache_dir, budget,
+         args.warm_start, args.refit, not args.no_wandb, args.wandb_project)
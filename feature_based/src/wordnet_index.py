@@ -0,0 +1,92 @@
+'''
+Precomputed WordNet features for every WordNet lemma.
+
+Usage (from feature_based/src, after pip install -e . at the repository root, see README.md):
+python wordnet_index.py [--workers N]
+
+Output: WORDNET_INDEX_DIR with words.txt (sorted lemma names) and features.npy
+(int32, one row of num_synsets, num_hypernyms, num_hyponyms per word), loaded memory-mapped.
+Words that are not in the index are computed on the fly and memoized.
+'''
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from lcp.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+WORDNET_INDEX_DIR = '../data/features/wordnet_index'
+WORDNET_FEATURES = ['num_synsets', 'num_hypernyms', 'num_hyponyms']
+
+_memo = {}
+
+
+def wordnet_word_features(word):
+    from nltk.corpus import wordnet  # slow to import; only needed for words missing from the index
+    synsets = wordnet.synsets(word)
+
+    hyper_num = 0
+    hypon_num = 0
+    for syn in synsets:
+        if syn.lemmas()[0].name() == word: # synset of current word
+            hyper_num += len(syn.hypernyms())
+            hypon_num += len(syn.hyponyms())
+    return len(synsets), hyper_num, hypon_num
+
+
+def compute_wordnet_features(words, workers=1):
+    '''
+    WordNet features for a list of words, memoized across calls.
+    With workers > 1, words not computed yet are spread over a process pool.
+    '''
+    missing = [w for w in dict.fromkeys(words) if w not in _memo]
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            computed = list(executor.map(wordnet_word_features, missing, chunksize=max(1, len(missing) // (workers * 4))))
+    else:
+        computed = [wordnet_word_features(w) for w in missing]
+    _memo.update(zip(missing, computed))
+
+    return np.array([_memo[w] for w in words], dtype=np.int32).reshape(len(words), len(WORDNET_FEATURES))
+
+
+class WordNetIndex:
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'words.txt'), 'r', encoding='utf-8') as f:
+            self.words = np.array(f.read().split('\n'))
+        self.features = np.load(os.path.join(index_dir, 'features.npy'), mmap_mode='r')
+
+    def lookup(self, words):
+        '''
+        Returns the feature rows for words and a mask of the words found in the index
+        (rows of words not found are 0).
+        '''
+        words = np.asarray(words, dtype=str)
+        positions = np.searchsorted(self.words, words).clip(max=len(self.words) - 1)
+        found = self.words[positions] == words
+        features = np.zeros((len(words), len(WORDNET_FEATURES)), dtype=np.int32)
+        features[found] = self.features[positions[found]]
+        return features, found
+
+
+def build_wordnet_index(index_dir, workers=1):
+    from nltk.corpus import wordnet
+    words = sorted(set(wordnet.all_lemma_names()))
+    print(f'Computing WordNet features for {len(words)} lemmas...')
+    features = compute_wordnet_features(words, workers)
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, 'features.npy'), features)
+    with open(os.path.join(index_dir, 'words.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(words))
+    print(f'Saved WordNet index to {index_dir}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index_dir', default=WORDNET_INDEX_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    build_wordnet_index(args.index_dir, args.workers)
@@ -0,0 +1,5 @@
+import sys
+
+from lcp.cli import main
+
+sys.exit(main())
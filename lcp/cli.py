@@ -0,0 +1,62 @@
+'''
+One entry point for the pipeline scripts:
+
+    lcp <command> [options]          (after pip install -e . in the repository)
+    python -m lcp <command> [options]  (from the repository root)
+
+A command runs its script from context_based/src or feature_based/src with the remaining options,
+as if the script was run directly from the current directory (python -m lcp tag --help shows the
+options of tag_cefr.py). Only the standard library is imported until a command is chosen, and the
+scripts import scikit-learn, scipy, NLTK and the training libraries only where they are used.
+'''
+import os
+import sys
+import runpy
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# command: (script relative to the repo root, options passed before the user's, description)
+COMMANDS = {
+    'parse': ('context_based/src/parse_bnc_xml.py', ['--xml'], 'Parse BNC XML files into token tables'),
+    'metadata': ('context_based/src/parse_bnc_xml.py', ['--metadata'], 'Parse the metadata of BNC XML files'),
+    'tag': ('context_based/src/tag_cefr.py', [], 'Tag token tables with CEFR levels'),
+    'filter': ('context_based/src/filter_unk.py', [], 'Drop sentences with unknown words'),
+    'pipeline': ('context_based/src/pipeline.py', [], 'Parse, tag and filter in one pass'),
+    'stats': ('context_based/src/corpus_stats.py', [], 'Count corpus frequency features'),
+    'index': ('context_based/src/context_index.py', [], 'Build or query the (Lemma, POS) context index'),
+    'extract': ('feature_based/src/feature_extractor.py', [], 'Extract word features'),
+    'train': ('feature_based/src/train.py', [], 'Train the complexity regressor'),
+    'evaluate': ('feature_based/src/evaluate.py', [], 'Evaluate a trained model'),
+    'predict': ('feature_based/src/predict.py', [], 'Predict complexity scores for words'),
+    'distill': ('feature_based/src/distill.py', [], 'Distill the trained ensemble into a single model'),
+    'wordnet-index': ('feature_based/src/wordnet_index.py', [], 'Build the precomputed WordNet feature index'),
+}
+
+
+def usage():
+    lines = ['usage: python -m lcp <command> [options]', '', 'commands:']
+    lines += [f'  {command:<14} {description}' for command, (_, _, description) in COMMANDS.items()]
+    lines += ['', "Run 'python -m lcp <command> --help' for the options of a command."]
+    return '\n'.join(lines)
+
+
+def run(command, args):
+    script, fixed_args, _ = COMMANDS[command]
+    path = os.path.join(REPO_ROOT, script)
+    if not os.path.exists(path):
+        sys.exit(f'lcp: {path} not found; install lcp from a checkout with pip install -e .')
+    sys.argv = [path] + fixed_args + list(args)
+    sys.path.insert(0, os.path.dirname(path))  # the scripts import their sibling modules
+    runpy.run_path(path, run_name='__main__')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    if argv[0] not in COMMANDS:
+        print(f"{usage()}\n\nlcp: unknown command '{argv[0]}'", file=sys.stderr)
+        return 2
+    run(argv[0], argv[1:])
+    return 0
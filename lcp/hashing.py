@@ -0,0 +1,26 @@
+'''
+Content hashes of input files, shared by the lexicon cache, the manifest, the feature store and training.
+'''
+import os
+import hashlib
+import functools
+
+
+def sha256_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _sha256_file_version(path, size, mtime_ns):
+    return sha256_file(path)
+
+
+# sha256_file cached per (path, size, mtime) for the life of the process, so an unchanged file is
+# hashed once however often it is asked for
+def cached_sha256_file(path):
+    stat = os.stat(path)
+    return _sha256_file_version(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
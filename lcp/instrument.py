@@ -0,0 +1,210 @@
+'''
+Shared instrumentation for the pipeline scripts.
+
+Wrap a stage, or one unit of it (a directory, a file, a feature group), in stage():
+
+    with stage('tag', unit='A') as record:
+        record.read(input_path)
+        ...
+        record.rows(rows_in=len(df), rows_out=len(df))
+        record.wrote(output_path)
+
+When the block ends one JSON line is emitted with wall and CPU time, rows in/out,
+bytes read/written, peak RSS and any extra fields. peak_rss_mb is the peak of the stage itself
+(Linux only: the kernel's high-water mark is reset when a stage starts); process_peak_rss_mb is the
+peak of the whole process so far. Lines are appended to the --metrics
+file ('-' for stderr); without --metrics nothing is emitted. record.progress() prints at most one
+progress line per --progress_interval seconds. Stages named in --profile (name, or
+name:unit for a single unit) run under cProfile and their profile is dumped to --profile_dir.
+'''
+import os
+import sys
+import json
+import time
+import socket
+import cProfile
+import contextlib
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+config = {'metrics': None, 'profile': set(), 'profile_dir': 'profiles', 'progress_interval': 1.0}
+_active_profiler = None
+_open_stages = []  # records of the stages running in this process, outermost first
+_reset_peak_mb = 0.0  # highest peak RSS read before a reset_peak_rss, which also resets ru_maxrss
+
+
+def configure(metrics=None, profile=(), profile_dir='profiles', progress_interval=1.0):
+    config.update({'metrics': metrics, 'profile': set(profile or ()), 'profile_dir': profile_dir,
+                   'progress_interval': progress_interval})
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', default=None, help="Append per-stage metrics (JSON lines) to this file ('-' for stderr)")
+    parser.add_argument('--profile', nargs='*', default=[], help='Stages (name or name:unit) to run under cProfile')
+    parser.add_argument('--profile_dir', default='profiles', help='Where profiles are dumped')
+    parser.add_argument('--progress_interval', type=float, default=1.0, help='Seconds between progress lines')
+
+
+def configure_from_args(args):
+    configure(args.metrics, args.profile, args.profile_dir, args.progress_interval)
+
+
+def process_peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if resource is None:
+        return None, None
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20, _reset_peak_mb)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20
+    return own, children
+
+
+# Peak RSS (VmHWM) since the process started or since the last reset_peak_rss; None where unavailable
+def current_peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+# Linux: writing 5 to clear_refs resets the peak RSS of the process to its current RSS
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def emit(line):
+    if not config['metrics']:
+        return
+    data = json.dumps(line, default=str)
+    if config['metrics'] == '-':
+        print(data, file=sys.stderr, flush=True)
+    else:
+        with open(config['metrics'], 'a') as f:
+            f.write(data + '\n')
+
+
+class StageRecord:
+    def __init__(self, name, unit=None, **fields):
+        self.name = name
+        self.unit = unit
+        self.fields = fields
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.started = time.perf_counter()
+        self.last_progress = self.started
+        self.peak_rss_mb = None
+
+    @property
+    def label(self):
+        return self.name if self.unit is None else f'{self.name}:{self.unit}'
+
+    def rows(self, rows_in=0, rows_out=0):
+        self.rows_in += rows_in
+        self.rows_out += rows_out
+
+    def read(self, *paths):
+        self.bytes_read += sum(os.path.getsize(p) for p in paths)
+
+    def wrote(self, *paths):
+        self.bytes_written += sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+    # Accumulate the wall time of a sub-step (e.g. 'tag' inside the fused pipeline) into <name>_s
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            key = f'{name}_s'
+            self.fields[key] = self.fields.get(key, 0.0) + time.perf_counter() - start
+
+    def progress(self, done, total=None, what='files'):
+        now = time.perf_counter()
+        if now - self.last_progress < config['progress_interval'] and done != total:
+            return
+        self.last_progress = now
+        elapsed = max(now - self.started, 1e-9)
+        count = f'{done}/{total}' if total is not None else f'{done}'
+        print(f'[{self.label}] {count} {what} | {self.rows_in} rows in, {self.rows_out} rows out '
+              f'({self.rows_in / elapsed:.0f} rows/sec) | {elapsed:.1f}s', flush=True)
+
+
+@contextlib.contextmanager
+def stage(name, unit=None, **fields):
+    global _active_profiler, _reset_peak_mb
+    record = StageRecord(name, unit, **fields)
+
+    profiler = None
+    if _active_profiler is None and (name in config['profile'] or record.label in config['profile']):
+        profiler = _active_profiler = cProfile.Profile()
+
+    # the peak so far belongs to the enclosing stages; keep it before resetting the high-water mark
+    peak = current_peak_rss_mb()
+    for outer in _open_stages:
+        outer.peak_rss_mb = max(outer.peak_rss_mb or 0.0, peak or 0.0)
+    if peak is not None and reset_peak_rss():
+        _reset_peak_mb = max(_reset_peak_mb, peak)
+        record.peak_rss_mb = 0.0
+    _open_stages.append(record)
+
+    start_times = os.times()
+    start = time.perf_counter()
+    status = 'ok'
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            _active_profiler = None
+            os.makedirs(config['profile_dir'], exist_ok=True)
+            profile_path = os.path.join(config['profile_dir'], f"{record.label.replace(':', '-')}.prof")
+            profiler.dump_stats(profile_path)
+            record.fields['profile'] = profile_path
+            print(f'Saved profile of {record.label} to {profile_path} (view with python -m pstats {profile_path})')
+
+        wall = time.perf_counter() - start
+        end_times = os.times()
+        _open_stages.remove(record)
+        if record.peak_rss_mb is not None:
+            record.peak_rss_mb = max(record.peak_rss_mb, current_peak_rss_mb() or 0.0)
+        own_rss, children_rss = process_peak_rss_mb()
+        emit({
+            'stage': name,
+            'unit': unit,
+            'status': status,
+            'wall_s': wall,
+            'cpu_s': (end_times.user + end_times.system) - (start_times.user + start_times.system),
+            'children_cpu_s': (end_times.children_user + end_times.children_system)
+                              - (start_times.children_user + start_times.children_system),
+            'rows_in': record.rows_in,
+            'rows_out': record.rows_out,
+            'rows_per_sec': record.rows_in / max(wall, 1e-9),
+            'bytes_read': record.bytes_read,
+            'bytes_written': record.bytes_written,
+            'peak_rss_mb': record.peak_rss_mb,
+            'process_peak_rss_mb': own_rss,
+            'children_process_peak_rss_mb': children_rss,
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'time': time.time(),
+            **record.fields,
+        })
@@ -0,0 +1,23 @@
+'''
+Deferred imports for the pipeline scripts:
+
+    pd = lazy_import('pandas')
+
+binds a module whose import runs on first attribute access (importlib.util.LazyLoader), so a script
+that only prints --help, or stops at a usage error, never pays for pandas or numpy.
+'''
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
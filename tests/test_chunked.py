@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import tag_cefr
+from synthetic import make_vocabulary, write_cefr_wordlists
+from token_store import read_table, write_table, iter_groups
+from filter_unk import filter_unk_df, filter_unk_chunked, sentence_key
+from parse_bnc_xml import COLUMNS
+
+# smaller than most sentences, so sentences are split over chunks of the file
+CHUNKSIZE = 7
+
+
+@pytest.fixture(scope='module')
+def vocab():
+    return make_vocabulary(500)
+
+
+def token_table(vocab, n_sentences=60, seed=777):
+    # sentences of 1-30 tokens; SentenceIDs restart in every XML file, as in the BNC
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 31, size=n_sentences)
+    n = int(lengths.sum())
+    picks = rng.choice(len(vocab), size=n, p=vocab['p'].to_numpy())
+    df = vocab.iloc[picks][['Lemma', 'POS', 'c5']].reset_index(drop=True)
+    xml_ids = np.repeat(np.where(np.arange(n_sentences) < n_sentences // 2, 'A00', 'A01'), lengths)
+    sentence_ids = np.repeat(np.arange(n_sentences) % (n_sentences // 2) + 1, lengths)
+    df['XML_ID'] = xml_ids
+    df['SentenceID'] = sentence_ids
+    df['TokenID'] = np.concatenate([np.arange(1, length + 1) for length in lengths])
+    df['Token'] = df['Lemma']
+    return df[COLUMNS]
+
+
+def plain(df):
+    # categorical columns (Parquet, chunked TSV reads) as plain values, for comparing frames read differently
+    return df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)}) \
+        .reset_index(drop=True)
+
+
+@pytest.mark.parametrize('extension', ['.tsv', '.parquet'])
+def test_iter_groups_keeps_sentences_in_one_chunk(vocab, tmp_path, extension):
+    path = str(tmp_path / f'A{extension}')
+    df = token_table(vocab)
+    write_table(df, path)
+
+    chunks = list(iter_groups(path, sentence_key, chunksize=CHUNKSIZE))
+    sentences = [set(zip(chunk['XML_ID'], chunk['SentenceID'])) for chunk in chunks]
+    assert len(chunks) > 1
+    assert all(a.isdisjoint(b) for a, b in zip(sentences, sentences[1:]))
+    pd.testing.assert_frame_equal(plain(pd.concat([plain(chunk) for chunk in chunks])), plain(read_table(path)),
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('extension', ['.tsv', '.parquet'])
+def test_filter_unk_chunked_matches_full_table(vocab, tmp_path, extension):
+    rng = np.random.default_rng(777)
+    df = token_table(vocab)
+    df['CEFR'] = np.where(rng.random(len(df)) < 0.02, 'UNK', 'A1')
+    input_path, output_path = str(tmp_path / f'A_tagged{extension}'), str(tmp_path / f'A_filtered{extension}')
+    write_table(df, input_path)
+
+    stats = filter_unk_chunked(input_path, output_path, CHUNKSIZE)
+    expected, expected_stats = filter_unk_df(read_table(input_path))
+
+    assert 0 < stats['sentences_dropped'] < 60
+    assert stats == expected_stats
+    pd.testing.assert_frame_equal(plain(read_table(output_path)), plain(expected), check_dtype=False)
+
+
+@pytest.mark.parametrize('file_format', ['tsv', 'parquet'])
+@pytest.mark.parametrize('disambiguator', [None, 'sentence'])
+def test_tag_cefr_level_with_memory_budget_matches_full_load(vocab, tmp_path, monkeypatch, file_format, disambiguator):
+    cefr_path, extended_path = write_cefr_wordlists(str(tmp_path), vocab)
+    processed_dir = tmp_path / 'processed'
+    processed_dir.mkdir()
+    write_table(token_table(vocab), str(processed_dir / f'A{tag_cefr.FORMATS[file_format]}'))
+
+    def tag(tagged_dir, memory_mb=None):
+        tag_cefr.tag_cefr_level(cefr_path, extended_path, ['A'], str(processed_dir), str(tagged_dir),
+                                file_format=file_format, memory_mb=memory_mb, disambiguator=disambiguator)
+        return plain(read_table(str(tagged_dir / f'A_tagged{tag_cefr.FORMATS[file_format]}')))
+
+    (tmp_path / 'full').mkdir()
+    (tmp_path / 'chunked').mkdir()
+    full = tag(tmp_path / 'full')
+    # the budget only sets the chunk size; force chunks smaller than a sentence
+    monkeypatch.setattr(tag_cefr, 'rows_for_budget', lambda path, memory_mb: CHUNKSIZE)
+    chunked = tag(tmp_path / 'chunked', memory_mb=1)
+
+    assert full['CEFR'].nunique() > 2
+    pd.testing.assert_frame_equal(chunked, full, check_dtype=False)
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from filter_unk import filter_unk_df
+
+COLUMNS = ['XML_ID', 'SentenceID', 'TokenID', 'Lemma', 'POS', 'c5', 'CEFR']
+
+
+def test_same_sentence_id_in_two_files():
+    # sentence 1 of A00 has a disallowed UNK; sentence 1 of B00 only has one kept as UNK (a proper noun)
+    df = pd.DataFrame([
+        ('A00', 1, 1, 'the', 'ART', 'AT0', 'A1'),
+        ('A00', 1, 2, 'xyzzy', 'SUBST', 'NN1', 'UNK'),
+        ('A00', 2, 1, 'cat', 'SUBST', 'NN1', 'A1'),
+        ('B00', 1, 1, 'london', 'SUBST', 'NP0', 'UNK'),
+        ('B00', 1, 2, 'be', 'VERB', 'VBZ', 'A1'),
+        ('B00', 1, 3, 'big', 'ADJ', 'AJ0', 'A1'),
+    ], columns=COLUMNS)
+
+    filtered, stats = filter_unk_df(df)
+
+    assert list(zip(filtered['XML_ID'], filtered['SentenceID'])) == [('A00', 2), ('B00', 1), ('B00', 1), ('B00', 1)]
+    assert stats == {'tokens_kept': 4, 'tokens_dropped': 2, 'sentences_kept': 2, 'sentences_dropped': 1}
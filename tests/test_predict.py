@@ -0,0 +1,50 @@
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+import syllables
+from sklearn.linear_model import Ridge
+
+from predict import Predictor
+
+FEATURES_TO_USE = {'surface_features': [], 'extract_from_file': {'freq.csv': ['freq', 'aoa']}}
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    rng = np.random.default_rng(777)
+    words = [f'word{i}' for i in range(200)]
+    (tmp_path / 'features').mkdir()
+    pd.DataFrame({'word': words, 'freq': rng.random(200), 'aoa': rng.random(200)}) \
+        .to_csv(tmp_path / 'features' / 'freq.csv', index=False)
+
+    # the run file orders the columns differently from the extractor
+    columns = ['aoa', 'freq', 'syllable_length', 'word_length']
+    x = rng.random((200, len(columns)))
+    with open(tmp_path / 'm.pkl', 'wb') as f:
+        pickle.dump(Ridge().fit(x, x @ np.arange(1, len(columns) + 1)), f)
+    with open(tmp_path / 'm_run.json', 'w') as f:
+        json.dump({'columns': columns}, f)
+    return tmp_path
+
+
+def test_predict_orders_columns_as_the_run_file(model_dir, capsys):
+    predictor = Predictor(str(model_dir / 'm.pkl'), features_to_use=FEATURES_TO_USE,
+                          feature_dir=str(model_dir / 'features'), wordnet_index_dir=None)
+    words = ['word3', 'Word7', 'unknown']
+    table = pd.read_csv(model_dir / 'features' / 'freq.csv').set_index('word')
+    x = np.array([[table['aoa'].get(w.lower(), 0), table['freq'].get(w.lower(), 0), syllables.estimate(w.lower()),
+                   len(w)] for w in words])
+    capsys.readouterr()
+
+    np.testing.assert_allclose(predictor.predict(words), predictor.model.predict(x))
+    # quiet: the server predicts every micro-batch
+    assert capsys.readouterr().out == ''
+
+
+def test_predictor_rejects_missing_feature_groups(model_dir):
+    with pytest.raises(ValueError, match=r"\['aoa', 'freq'\]"):
+        Predictor(str(model_dir / 'm.pkl'), features_to_use={'surface_features': []},
+                  feature_dir=str(model_dir / 'features'), wordnet_index_dir=None)
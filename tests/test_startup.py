@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from lcp.cli import COMMANDS, REPO_ROOT
+from run_benchmarks import measure_startup, STARTUP_BUDGET
+
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'scipy', 'sklearn', 'nltk']
+
+# Runs `lcp <command> --help`, then prints the heavy packages that were actually loaded. Modules deferred
+# with lcp.lazy.lazy_import are in sys.modules before they load, but their submodules are not.
+LOADED_AFTER_HELP = '''
+import sys
+from lcp.cli import main
+command, heavy = sys.argv[1], sys.argv[2].split(',')  # main() replaces sys.argv
+try:
+    main([command, '--help'])
+except SystemExit:
+    pass
+print('loaded:' + ','.join(sorted({name.split('.')[0] for name in sys.modules if '.' in name and name.split('.')[0] in heavy})))
+'''
+
+
+@pytest.mark.parametrize('command', list(COMMANDS))
+def test_help_does_not_load_heavy_modules(command):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-c', LOADED_AFTER_HELP, command, ','.join(HEAVY_MODULES)],
+                            env=env, capture_output=True, text=True, check=True)
+    loaded = result.stdout.splitlines()[-1][len('loaded:'):]
+    assert loaded == '', f'lcp {command} --help loads {loaded}'
+
+
+@pytest.mark.parametrize('command', [None] + list(COMMANDS))
+def test_help_within_startup_budget(command):
+    seconds = measure_startup([command], repeat=3)[command or 'lcp']
+    assert seconds < STARTUP_BUDGET, f'lcp {command or ""} --help took {seconds:.3f}s, budget {STARTUP_BUDGET}s'
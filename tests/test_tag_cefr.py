@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic import make_vocabulary, write_cefr_wordlists
+from tag_cefr import create_cefr_dict, create_cefr_dict_from_extended, compile_cefr_table, tag_cefr_rowwise, \
+    tag_cefr_vectorized
+
+COLUMNS = ['XML_ID', 'SentenceID', 'Lemma', 'POS', 'c5']
+
+
+@pytest.fixture(scope='module')
+def lexicon(tmp_path_factory):
+    out_dir = tmp_path_factory.mktemp('cefr')
+    vocab = make_vocabulary(2000)
+    cefr_path, extended_path = write_cefr_wordlists(str(out_dir), vocab)
+
+    # words the BNC tags differently from the wordlist: 'than' is keyed on (Lemma, POS, c5) through
+    # exception_in_bnc and 'as' expands to several POS
+    with open(cefr_path) as f:
+        wordlist = json.load(f)
+    wordlist['than'] = [{'pos': 'preposition', 'level': 'A2'}, {'pos': 'conjunction', 'level': 'A1'}]
+    wordlist['as'] = [{'pos': 'adverb; preposition', 'level': 'B1'}, {'pos': 'adverb', 'level': 'A2'}]
+    with open(cefr_path, 'w') as f:
+        json.dump(wordlist, f)
+
+    cefr_dict = create_cefr_dict(cefr_path)
+    extended_cefr_dict = create_cefr_dict_from_extended(cefr_dict.keys(), extended_path)
+    return vocab, cefr_dict, extended_cefr_dict
+
+
+def token_frame(vocab, n=5000, seed=777):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vocab), size=n, p=vocab['p'].to_numpy())
+    df = vocab.iloc[picks][['Lemma', 'POS', 'c5']].reset_index(drop=True)
+    special = pd.DataFrame([
+        ('than', 'CONJ', 'CJS'), ('than', 'PREP', 'PRP'),
+        ('as', 'PREP', 'PRP'), ('as', 'CONJ', 'CJS'), ('as', 'ADV', 'AV0'), ('as', 'VERB', 'VVB'),
+        ('there', 'PRON', 'EX0'), ('shall', 'VM0', 'VM0'),
+        (np.nan, 'SUBST', 'NN1'), (np.nan, 'STOP', 'PUN'), (np.nan, np.nan, np.nan),
+    ], columns=['Lemma', 'POS', 'c5'])
+    df = pd.concat([df, special], ignore_index=True).sample(frac=1, random_state=seed).reset_index(drop=True)
+    df.insert(0, 'XML_ID', 'A00')
+    df.insert(1, 'SentenceID', np.arange(len(df)) // 15 + 1)
+    return df[COLUMNS]
+
+
+def assert_same_tags(df, cefr_dict, extended_cefr_dict=None):
+    rowwise = tag_cefr_rowwise(df, cefr_dict, extended_cefr_dict)
+    vectorized = tag_cefr_vectorized(df, compile_cefr_table(cefr_dict),
+                                     compile_cefr_table(extended_cefr_dict) if extended_cefr_dict is not None else None)
+    assert vectorized.index.equals(df.index)
+    np.testing.assert_array_equal(vectorized.to_numpy(), rowwise.to_numpy())
+    return vectorized
+
+
+def test_vectorized_matches_rowwise(lexicon):
+    vocab, cefr_dict, _ = lexicon
+    tags = assert_same_tags(token_frame(vocab), cefr_dict)
+    assert tags.nunique() > 2
+
+
+def test_vectorized_matches_rowwise_with_extended_wordlist(lexicon):
+    vocab, cefr_dict, extended_cefr_dict = lexicon
+    assert any(len(key) == 2 for key in extended_cefr_dict)
+    assert any(len(key) == 3 for key in extended_cefr_dict)
+    assert_same_tags(token_frame(vocab), cefr_dict, extended_cefr_dict)
+
+
+def test_vectorized_matches_rowwise_on_categorical_input(lexicon):
+    vocab, cefr_dict, extended_cefr_dict = lexicon
+    df = token_frame(vocab).astype({c: 'category' for c in ('XML_ID', 'Lemma', 'POS', 'c5')})
+    assert_same_tags(df, cefr_dict, extended_cefr_dict)
+
+
+def test_special_keys(lexicon):
+    vocab, cefr_dict, extended_cefr_dict = lexicon
+    assert ('than', 'CONJ', 'CJS') in cefr_dict
+    assert {('as', 'PREP'), ('as', 'CONJ'), ('as', 'ADV')} <= set(cefr_dict)
+    assert any(len(key) == 3 and key[0] != 'than' for key in cefr_dict)
+
+    df = token_frame(vocab)
+    tags = assert_same_tags(df, cefr_dict, extended_cefr_dict)
+    lemma = df['Lemma']
+    assert (tags[(lemma == 'than') & (df['c5'] == 'CJS')] == 'A1').all()
+    assert (tags[(lemma == 'as') & (df['POS'] == 'ADV')] == 'A2').all()
+    assert (tags[lemma.isna()] == 'UNK').all()
@@ -0,0 +1,130 @@
+import json
+import pickle
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import train
+
+# hyperparameters of the fake configuration space
+SPACE = {'regressor:__choice__', 'regressor:ridge:alpha'}
+
+
+class Configuration:
+    def __init__(self, space, values):
+        unknown = set(values) - space
+        if unknown:
+            raise ValueError(f'unknown hyperparameters {sorted(unknown)}')
+        self.values = values
+
+
+class AutoSklearnRegressor:
+    # records its arguments; fit runs the smac callback as the search does
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.get_smac_object_callback = kwargs['get_smac_object_callback']
+        AutoSklearnRegressor.instances.append(self)
+
+    def fit(self, x, y, X_test=None, y_test=None):
+        if self.get_smac_object_callback is not None:
+            self.get_smac_object_callback(scenario_dict={'cs': SPACE}, seed=1,
+                                          metalearning_configurations=['meta-1', 'meta-2'])
+        return self
+
+
+class Ensemble:
+    # a trained ensemble as main() loads it for --refit
+    def __init__(self):
+        self.refit_rows = None
+
+    def refit(self, x, y):
+        self.refit_rows = len(x)
+        return self
+
+    def predict(self, x):
+        return x.sum(axis=1)
+
+    def get_models_with_weights(self):
+        return []
+
+
+@pytest.fixture
+def smac_calls(monkeypatch):
+    calls = []
+    modules = {
+        'autosklearn': {},
+        'autosklearn.regression': {'AutoSklearnRegressor': AutoSklearnRegressor},
+        'autosklearn.smbo': {'get_smac_object': lambda **smac_args: calls.append(smac_args)},
+        'ConfigSpace': {'Configuration': Configuration},
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        monkeypatch.setitem(sys.modules, name, module)
+    AutoSklearnRegressor.instances.clear()
+    return calls
+
+
+def test_warm_start_evaluates_previous_configurations_first(smac_calls):
+    previous = [{'regressor:__choice__': 'ridge', 'regressor:ridge:alpha': 0.1},
+                {'regressor:__choice__': 'removed', 'regressor:removed:depth': 3},
+                {'regressor:__choice__': 'ridge', 'regressor:ridge:alpha': 10.0}]
+    x = np.zeros((10, 2))
+    regressor = train.train_model(x, np.zeros(10), x, np.zeros(10), train.BUDGET, warm_start=previous)
+
+    (smac_args,) = smac_calls
+    configurations = smac_args['metalearning_configurations']
+    # the configuration that does not fit the space is skipped
+    assert [c.values for c in configurations[:2]] == [previous[0], previous[2]]
+    assert configurations[2:] == ['meta-1', 'meta-2']
+    assert isinstance(AutoSklearnRegressor.instances[0].kwargs['get_smac_object_callback'], train.WarmStart)
+    assert regressor.get_smac_object_callback is None
+
+
+def test_without_warm_start_the_default_search_runs(smac_calls):
+    x = np.zeros((10, 2))
+    train.train_model(x, np.zeros(10), x, np.zeros(10), train.BUDGET)
+    assert AutoSklearnRegressor.instances[0].kwargs['get_smac_object_callback'] is None
+    assert smac_calls == []
+
+
+@pytest.fixture
+def previous_run(tmp_path):
+    rng = np.random.default_rng(777)
+    feature_file = tmp_path / 'features.csv'
+    df = pd.DataFrame({'word': [f'word{i}' for i in range(50)], 'freq': rng.random(50), 'aoa': rng.random(50),
+                       'score': rng.random(50)})
+    df.to_csv(feature_file, index=False)
+    with open(tmp_path / 'previous.pkl', 'wb') as f:
+        pickle.dump(Ensemble(), f)
+    return feature_file, tmp_path / 'previous.pkl'
+
+
+def write_run(path, model, columns):
+    with open(path, 'w') as f:
+        json.dump({'model': str(model), 'columns': columns, 'configurations': []}, f)
+    return str(path)
+
+
+def test_refit_rejects_changed_columns(previous_run, tmp_path):
+    feature_file, model = previous_run
+    run_file = write_run(tmp_path / 'previous_run.json', model, ['freq', 'length'])
+    with pytest.raises(ValueError, match='other feature columns'):
+        train.main(str(feature_file), str(tmp_path / 'refit'), cache_dir=None, refit=run_file, use_wandb=False)
+
+
+def test_refit_keeps_the_previous_ensemble(previous_run, tmp_path):
+    feature_file, model = previous_run
+    run_file = write_run(tmp_path / 'previous_run.json', model, ['freq', 'aoa'])
+    train.main(str(feature_file), str(tmp_path / 'refit'), cache_dir=None, refit=run_file, use_wandb=False)
+
+    with open(tmp_path / 'refit.pkl', 'rb') as f:
+        assert pickle.load(f).refit_rows == 45  # the training split
+    with open(tmp_path / 'refit_run.json') as f:
+        run = json.load(f)
+    assert run['refit'] == run_file and run['columns'] == ['freq', 'aoa']